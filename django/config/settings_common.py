@@ -39,11 +39,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'markdownify',
     'crispy_forms',
 ]
 
 MIDDLEWARE = [
+    'qanda.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,13 +53,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'qanda.middleware.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'config.template_backends.InstrumentedDjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates')
         ],
@@ -85,6 +88,27 @@ DATABASES = {
     }
 }
 
+# Per-process performance metrics, exposed in the Prometheus format at
+# /metrics to staff and to scrapers sending "Authorization: Bearer
+# METRICS_TOKEN". Requests slower than METRICS_SLOW_REQUEST_SECONDS are
+# logged to qanda.slow_requests with their slowest queries.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.getenv('DJANGO_METRICS_TOKEN')
+METRICS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_SLOW_REQUEST_SECONDS = None
+METRICS_SLOW_QUERIES_LOGGED = 5
+
+# Read replicas: aliases in DATABASES that read-heavy views may read from
+# while their lag is within REPLICA_MAX_LAG seconds. Clients that wrote in
+# the last REPLICA_PIN_SECONDS read from the primary.
+DATABASE_ROUTERS = ['qanda.service.replicas.ReplicaRouter']
+REPLICA_DATABASES = []
+REPLICA_MAX_LAG = 5
+REPLICA_LAG_CHECK_INTERVAL = 5
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_COOKIE = 'pin_primary'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -119,6 +143,30 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
@@ -136,6 +184,10 @@ MARKDOWNIFY_WHITELIST_TAGS = [
     'h6', 'h7', 'li', 'ol', 'p', 'strong', 'ul',
 ]
 
+# Live Markdown preview (q/preview)
+MARKDOWN_PREVIEW_MAX_LENGTH = 20000
+MARKDOWN_PREVIEW_CACHE_SIZE = 512
+
 # Crispy Forms settings
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
@@ -144,10 +196,73 @@ LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'qanda:index'
 LOGOUT_REDIRECT_URL = 'qanda:index'
 
+# Question page settings
+ANSWERS_PAGE_SIZE = 30
+
+# JSON API (api/) page sizes
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Anonymous page cache: pages are fresh for PAGE_CACHE_TIMEOUT seconds and
+# may be served stale for PAGE_CACHE_GRACE more while one worker re-renders.
+PAGE_CACHE_ALIAS = 'pages'
+PAGE_CACHE_TIMEOUT = 600
+PAGE_CACHE_GRACE = 60
+PAGE_CACHE_LOCK_TIMEOUT = 10
+PAGE_CACHE_LOCK_WAIT = 2
+
 # ElasticSearch settings
+# ES_INDEX is an alias onto the live versioned index; ES_BUILD_ALIAS marks an
+# index being rebuilt by load_questions_into_elasticsearch.
 ES_INDEX = 'answerly'
+ES_BUILD_ALIAS = 'answerly_build'
+ES_NUMBER_OF_SHARDS = 1
+ES_NUMBER_OF_REPLICAS = 1
+ES_REFRESH_INTERVAL = '1s'
 ES_HOST = 'localhost'
 ES_PORT = '9200'
+# Connection pool per process; sized to the mod_wsgi thread count.
+ES_MAXSIZE = 15
+ES_TIMEOUT = 10
+ES_MAX_RETRIES = 3
+ES_RETRY_ON_TIMEOUT = True
+ES_KEEP_ALIVE = True
+# Outbox worker (manage.py drain_elasticsearch_outbox)
+ES_OUTBOX_BATCH_SIZE = 500
+ES_OUTBOX_POLL_INTERVAL = 1
+ES_OUTBOX_BACKOFF_BASE = 2
+ES_OUTBOX_BACKOFF_MAX = 300
+
+# Search backend: a module providing search_for_questions(), either
+# 'qanda.service.elasticsearch' or 'qanda.service.postgres_search'. The
+# fallback is used while the primary backend is unavailable.
+SEARCH_BACKEND = 'qanda.service.elasticsearch'
+SEARCH_FALLBACK_BACKEND = None
+# Text search configuration of postgres_search queries. It must match the
+# one the qanda_question_search_vector trigger builds search_vector with
+# (migration 0006), so changing it needs a new migration that recreates
+# the trigger and recomputes the column.
+SEARCH_CONFIG = 'english'
+
+# Search result cache
+SEARCH_CACHE_ALIAS = 'search'
+SEARCH_CACHE_TIMEOUT = 300
+SEARCH_PAGE_SIZE = 10
+# Deepest hit that from/size paging may reach: Elasticsearch's
+# index.max_result_window. Deeper pages need an `after` cursor.
+SEARCH_MAX_RESULT_WINDOW = 10000
+SEARCH_SNIPPET_SIZE = 150
+# Multiplies the score of an accepted answer matching a search.
+SEARCH_ACCEPTED_ANSWER_BOOST = 2.0
+# Authors listed in the search results' facets.
+SEARCH_FACET_SIZE = 10
+
+# Typeahead (q/typeahead)
+TYPEAHEAD_MIN_PREFIX = 2
+TYPEAHEAD_MAX_PREFIX = 50
+TYPEAHEAD_MAX_INPUTS = 8
+TYPEAHEAD_SIZE = 8
+TYPEAHEAD_MAX_AGE = 60
 
 # Chrome Driver
 CHROME_DRIVER = os.path.join(BASE_DIR, '../chromedriver')
@@ -18,6 +18,32 @@ DATABASES['default'].update({
     'PORT': os.getenv('DJANGO_DB_PORT'),
 })
 
+if os.getenv('DJANGO_DB_REPLICA_HOST'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        HOST=os.getenv('DJANGO_DB_REPLICA_HOST'),
+        PORT=os.getenv('DJANGO_DB_REPLICA_PORT', os.getenv('DJANGO_DB_PORT')),
+        TEST={'MIRROR': 'default'},
+    )
+    REPLICA_DATABASES = ['replica']
+
+# Content-hashed static files with precompressed siblings, served with
+# far-future cache headers by apache/answerly.apache.conf.
+STATICFILES_STORAGE = 'config.storage.CompressedManifestStaticFilesStorage'
+
+# The search and page caches must be shared by every mod_wsgi process and
+# the outbox worker so that invalidations reach all of them.
+CACHES['search'] = {
+    'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', '127.0.0.1:11211'),
+    'KEY_PREFIX': 'search',
+}
+CACHES['pages'] = {
+    'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    'LOCATION': os.getenv('DJANGO_CACHE_LOCATION', '127.0.0.1:11211'),
+    'KEY_PREFIX': 'pages',
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -31,6 +57,12 @@ LOGGING = {
         'django': {
             'handlers': ['logfile'],
         },
+        'qanda.slow_requests': {
+            'handlers': ['logfile'],
+            'level': 'WARNING',
+        },
     },
 }
 
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+
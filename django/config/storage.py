@@ -0,0 +1,59 @@
+import gzip
+import io
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (
+    '.css', '.js', '.json', '.map', '.svg', '.txt', '.html', '.xml',
+    '.eot', '.ttf',
+)
+MIN_COMPRESS_SIZE = 256
+
+
+def gzip_compress(content):
+    # mtime=0 keeps the output identical between builds.
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(content)
+    return buffer.getvalue()
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Content-hashed static files, with .gz and, when the brotli package is
+    installed, .br siblings of text assets written next to the hashed
+    files for Apache to serve as they are.
+    """
+
+    def post_process(self, *args, **kwargs):
+        hashed_names = []
+        for name, hashed_name, processed in super().post_process(
+                *args, **kwargs):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.append(hashed_name)
+            yield name, hashed_name, processed
+        for hashed_name in hashed_names:
+            if hashed_name.endswith(COMPRESSIBLE_EXTENSIONS):
+                self.compress(self.path(hashed_name))
+
+    def compress(self, path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        if len(content) < MIN_COMPRESS_SIZE:
+            return
+        variants = [('.gz', gzip_compress(content))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content)))
+        for suffix, compressed in variants:
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
@@ -0,0 +1,35 @@
+import time
+
+from django.template.backends.django import DjangoTemplates
+
+from qanda.service import metrics
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template engine, recording how long each top-level
+    template takes to render.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
+
+
+class InstrumentedTemplate:
+    def __init__(self, template):
+        self._wrapped = template
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self._wrapped.render(context, request)
+        finally:
+            metrics.record_template(
+                self._wrapped.origin.template_name or '<string>',
+                time.perf_counter() - started)
@@ -0,0 +1,241 @@
+import hashlib
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.generic import View
+
+from .models import Answer, Question
+from .service.keyset import created_page
+from .service.search import SearchUnavailable, search_for_questions
+from .views import ReplicaReadMixin
+
+# API field name: (column passed to only(), attribute path on the object).
+QUESTION_FIELDS = {
+    'id': ('id', 'id'),
+    'title': ('title', 'title'),
+    'question': ('question', 'question'),
+    'html': ('rendered_html', 'rendered_html'),
+    'user': ('user__username', 'user.username'),
+    'created': ('created', 'created'),
+    'modified': ('modified', 'modified'),
+}
+ANSWER_FIELDS = {
+    'id': ('id', 'id'),
+    'question': ('question', 'question_id'),
+    'answer': ('answer', 'answer'),
+    'html': ('rendered_html', 'rendered_html'),
+    'user': ('user__username', 'user.username'),
+    'created': ('created', 'created'),
+    'modified': ('modified', 'modified'),
+    'accepted': ('accepted', 'accepted'),
+}
+SEARCH_FIELDS = {
+    name: (name, name) for name in ('id', 'title', 'created', 'snippet')
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ApiView(ReplicaReadMixin, View):
+    """
+    Base for the read-only JSON API.
+
+    `fields` lists what a resource exposes. Clients may ask for a subset
+    with ?fields=a,b, and only those columns are selected. Responses carry
+    an ETag: subclasses that can cheaply tell whether their data changed
+    return a fingerprint from get_version() so conditional requests are
+    answered before any other work, otherwise the ETag hashes the body.
+    """
+    fields = {}
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.selected = self.get_selected_fields()
+            version = self.get_version()
+            etag = None
+            if version is not None:
+                etag = self.make_etag(version)
+                response = get_conditional_response(request, etag=etag)
+                if response is not None:
+                    return response
+            response = JsonResponse(self.get_data())
+        except Http404 as e:
+            return JsonResponse({'error': str(e) or 'Not found.'}, status=404)
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        if etag is None:
+            etag = self.make_etag(response.content)
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
+        response['ETag'] = etag
+        return response
+
+    def make_etag(self, version):
+        parts = (version, sorted(self.request.GET.items()))
+        return quote_etag(
+            hashlib.md5(repr(parts).encode('utf-8')).hexdigest())
+
+    def get_selected_fields(self):
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return list(self.fields)
+        selected = [name.strip() for name in requested.split(',')]
+        unknown = [name for name in selected if name not in self.fields]
+        if unknown:
+            raise ApiError('Unknown fields: {}'.format(', '.join(unknown)))
+        return selected
+
+    def get_version(self):
+        return None
+
+    def get_data(self):
+        raise NotImplementedError
+
+    def only(self, queryset):
+        """
+        Limit queryset to the selected columns, plus the ones created_page()
+        orders and pages by.
+        """
+        columns = {self.fields[name][0] for name in self.selected}
+        columns.update(('id', 'created'))
+        if any('__' in column for column in columns):
+            queryset = queryset.select_related('user')
+        return queryset.only(*columns)
+
+    def serialize(self, obj):
+        data = {}
+        for name in self.selected:
+            value = obj
+            for attribute in self.fields[name][1].split('.'):
+                value = getattr(value, attribute)
+            data[name] = value
+        return data
+
+    def get_size(self):
+        try:
+            size = int(self.request.GET.get('size', settings.API_PAGE_SIZE))
+        except ValueError:
+            raise ApiError('Invalid size.')
+        if not 1 <= size <= settings.API_MAX_PAGE_SIZE:
+            raise ApiError('size must be between 1 and {}.'.format(
+                settings.API_MAX_PAGE_SIZE))
+        return size
+
+    def get_page(self, queryset):
+        """
+        One page of queryset, newest first, continuing after ?after=.
+        """
+        try:
+            objects, next_cursor = created_page(
+                self.only(queryset), self.get_size(),
+                cursor=self.request.GET.get('after'))
+        except ValueError:
+            raise ApiError('Invalid cursor.')
+        return {
+            'results': [self.serialize(obj) for obj in objects],
+            'next': next_cursor,
+        }
+
+
+class QuestionListApiView(ApiView):
+    fields = QUESTION_FIELDS
+
+    def get_data(self):
+        return self.get_page(Question.objects.all())
+
+
+class QuestionApiView(ApiView):
+    fields = QUESTION_FIELDS
+
+    def get_version(self):
+        modified = Question.objects.filter(
+            pk=self.kwargs['pk']).values_list('modified', flat=True).first()
+        if modified is None:
+            raise Http404('No such question.')
+        return modified
+
+    def get_data(self):
+        try:
+            question = self.only(Question.objects.all()).get(
+                pk=self.kwargs['pk'])
+        except Question.DoesNotExist:
+            raise Http404('No such question.')
+        return self.serialize(question)
+
+
+class AnswerListApiView(ApiView):
+    fields = ANSWER_FIELDS
+
+    def get_version(self):
+        freshness = Question.objects.filter(pk=self.kwargs['pk']).aggregate(
+            question_modified=Max('modified'),
+            answer_modified=Max('answer__modified'),
+            answers=Count('answer'),
+        )
+        if freshness['question_modified'] is None:
+            raise Http404('No such question.')
+        return freshness['answer_modified'], freshness['answers']
+
+    def get_data(self):
+        return self.get_page(Answer.objects.filter(question=self.kwargs['pk']))
+
+
+class DailyQuestionListApiView(ApiView):
+    fields = QUESTION_FIELDS
+
+    def get_version(self):
+        freshness = self.get_queryset().aggregate(
+            last_modified=Max('modified'),
+            questions=Count('id'),
+        )
+        return freshness['last_modified'], freshness['questions']
+
+    def get_data(self):
+        return self.get_page(self.get_queryset())
+
+    def get_queryset(self):
+        try:
+            day = date(
+                self.kwargs['year'], self.kwargs['month'], self.kwargs['day'])
+        except ValueError:
+            raise Http404('Invalid date.')
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        return Question.objects.filter(
+            created__gte=start,
+            created__lt=start + timedelta(days=1),
+        )
+
+
+class SearchApiView(ApiView):
+    fields = SEARCH_FIELDS
+
+    def get_data(self):
+        query = self.request.GET.get('q')
+        if not query:
+            raise ApiError('q is required.')
+        try:
+            results = search_for_questions(
+                query, size=self.get_size(),
+                after=self.request.GET.get('after'))
+        except ValueError:
+            raise ApiError('Invalid cursor.')
+        except SearchUnavailable:
+            raise ApiError('Search is temporarily unavailable.', status=503)
+        return {
+            'results': [self.serialize(hit) for hit in results['hits']],
+            'total': results['total'],
+            'next': results['next'],
+        }
+
+    def serialize(self, hit):
+        return {name: hit.get(name) for name in self.selected}
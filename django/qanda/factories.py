@@ -1,10 +1,8 @@
-from unittest.mock import patch
-
 import factory
 
 from users.factories import UserFactory
 
-from .models import Question
+from .models import Answer, Question
 
 
 class QuestionFactory(factory.DjangoModelFactory):
@@ -15,7 +13,11 @@ class QuestionFactory(factory.DjangoModelFactory):
     class Meta:
         model = Question
 
-    @classmethod
-    def _create(cls, model_class, *args, **kwargs):
-        with patch('qanda.service.elasticsearch.Elasticsearch'):
-            return super()._create(model_class, *args, **kwargs)
+
+class AnswerFactory(factory.DjangoModelFactory):
+    answer = 'This is an answer.'
+    user = factory.SubFactory(UserFactory)
+    question = factory.SubFactory(QuestionFactory)
+
+    class Meta:
+        model = Answer
@@ -33,6 +33,16 @@ class AnswerForm(forms.ModelForm):
         fields = ['answer', 'user', 'question', ]
 
 
+class SearchFilterForm(forms.Form):
+    """
+    Narrows search results, see search.search_for_questions().
+    """
+    since = forms.DateField(required=False)
+    until = forms.DateField(required=False)
+    author = forms.CharField(required=False, max_length=150)
+    has_accepted = forms.NullBooleanField(required=False)
+
+
 class AnswerAcceptanceForm(forms.ModelForm):
     accepted = forms.BooleanField(
         widget=forms.HiddenInput,
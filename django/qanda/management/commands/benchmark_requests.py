@@ -0,0 +1,321 @@
+import json
+import platform
+import random
+import re
+import subprocess
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import timedelta
+from unittest.mock import patch
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.html import escape
+
+from qanda.factories import AnswerFactory, QuestionFactory
+from qanda.models import Answer, Question
+from qanda.service import elasticsearch, rendering
+from qanda.service.benchmarking import SYLLABLES, percentile
+from qanda.service.keyset import split_range
+from users.factories import UserFactory
+
+ENDPOINTS = [
+    'question_detail',
+    'question_detail_anonymous',
+    'daily_questions',
+    'search',
+    'ask',
+    'answer',
+]
+TOKEN_RE = re.compile(r'\w+')
+# Private caches, so runs neither read nor evict the configured ones.
+BENCHMARK_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark-{}'.format(alias),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+    for alias in ('default', 'search', 'pages')
+}
+
+
+class InProcessElasticsearch:
+    """
+    Enough of the Elasticsearch client for search_for_questions(), backed
+    by an in-memory inverted index, so benchmarks don't depend on a server.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.documents = {}
+        self.postings = defaultdict(Counter)
+
+    def add(self, document):
+        self.documents[document['id']] = document
+        text = '{} {}'.format(document['title'], document['question_body'])
+        for token in TOKEN_RE.findall(text.lower()):
+            self.postings[token][document['id']] += 1
+
+    def search(self, index, body):
+        scores = Counter()
+        query = body['query']['bool']['should'][0]['multi_match']['query']
+        for token in TOKEN_RE.findall(query.lower()):
+            scores.update(self.postings.get(token, {}))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if 'search_after' in body:
+            score, pk = body['search_after']
+            ranked = [
+                (i, s) for i, s in ranked
+                if s < score or (s == score and i > pk)
+            ]
+        else:
+            ranked = ranked[body['from']:]
+        hits = []
+        for pk, score in ranked[:body['size']]:
+            document = self.documents[pk]
+            hits.append({
+                '_source': {
+                    field: document[field] for field in body['_source']
+                },
+                'highlight': {'question_body': [escape(
+                    document['question_body'][:settings.SEARCH_SNIPPET_SIZE])]},
+                'sort': [score, pk],
+            })
+        return {
+            'hits': {'total': len(scores), 'hits': hits},
+            'aggregations': {
+                'months': {'buckets': []},
+                'authors': {'buckets': []},
+            },
+        }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(values):
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a corpus inside a rolled back transaction and report the '
+        'latency, SQL queries and peak memory of the main pages as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--questions', type=int, default=1000,
+            help='Questions to seed.')
+        parser.add_argument(
+            '--answers-per-question', type=int, default=10,
+            help='Answers seeded on each question.')
+        parser.add_argument(
+            '--users', type=int, default=20,
+            help='Users the questions and answers are spread over.')
+        parser.add_argument(
+            '--days', type=int, default=30,
+            help='Days the questions are spread over.')
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Timed requests per endpoint.')
+        parser.add_argument(
+            '--samples', type=int, default=20,
+            help='Requests per endpoint instrumented for SQL queries and '
+                 'memory, separately from the timed ones.')
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Untimed requests per endpoint made first.')
+        parser.add_argument(
+            '--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS,
+            help='Endpoints to benchmark.')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed, so runs on different commits are comparable.')
+        parser.add_argument(
+            '--output',
+            help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['questions'] < 1:
+            raise CommandError('--questions must be at least 1.')
+        search_engine = InProcessElasticsearch()
+        with override_settings(
+                CACHES=BENCHMARK_CACHES,
+                ALLOWED_HOSTS=['testserver'],
+                SEARCH_BACKEND='qanda.service.elasticsearch',
+                SEARCH_FALLBACK_BACKEND=None), \
+                patch('qanda.service.elasticsearch.Elasticsearch',
+                      return_value=search_engine), \
+                transaction.atomic():
+            elasticsearch.reset_client()
+            try:
+                report = self.run(search_engine, options)
+            finally:
+                elasticsearch.reset_client()
+                transaction.set_rollback(True)
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run(self, search_engine, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        users, questions = self.seed_corpus(rng, options)
+        for question in questions:
+            search_engine.add(question.as_elasticsearch_dict())
+        seed_seconds = time.perf_counter() - started
+
+        endpoints = {}
+        for endpoint in options['endpoints']:
+            make_request = getattr(self, 'request_' + endpoint)
+            client = Client()
+            if not endpoint.endswith('_anonymous'):
+                client.force_login(rng.choice(users))
+
+            def request():
+                return make_request(client, rng, questions)
+            for _ in range(options['warmup']):
+                request()
+            latencies, statuses = [], Counter()
+            for _ in range(options['requests']):
+                request_started = time.perf_counter()
+                response = request()
+                latencies.append(round(
+                    (time.perf_counter() - request_started) * 1000, 3))
+                statuses[str(response.status_code)] += 1
+            queries, peaks = [], []
+            for _ in range(options['samples']):
+                tracemalloc.start()
+                with CaptureQueriesContext(connection) as context:
+                    request()
+                peaks.append(tracemalloc.get_traced_memory()[1] // 1024)
+                tracemalloc.stop()
+                queries.append(len(context.captured_queries))
+            endpoints[endpoint] = {
+                'latency_ms': summarize(latencies),
+                'queries': summarize(queries) if queries else None,
+                'peak_memory_kb': summarize(peaks) if peaks else None,
+                'status_codes': dict(statuses),
+            }
+        return {
+            'meta': {
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'seed': options['seed'],
+                'questions': options['questions'],
+                'answers_per_question': options['answers_per_question'],
+                'users': options['users'],
+                'days': options['days'],
+                'requests': options['requests'],
+                'samples': options['samples'],
+                'seed_seconds': round(seed_seconds, 3),
+            },
+            'endpoints': endpoints,
+        }
+
+    def seed_corpus(self, rng, options):
+        """
+        Bulk create the corpus from the factories' defaults, bypassing
+        save() and its per-row rendering, outbox and cache writes.
+        """
+        users = UserFactory.create_batch(options['users'])
+        vocabulary = [
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(2000)
+        ]
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+        def words(n):
+            return ' '.join(rng.choices(vocabulary, weights, k=n))
+        version = rendering.get_renderer_version()
+        questions = []
+        for _ in range(options['questions']):
+            body = words(60)
+            questions.append(QuestionFactory.build(
+                title=words(6), question=body, user=rng.choice(users),
+                rendered_html=rendering.render_markdown(body),
+                rendered_version=version))
+        Question.objects.bulk_create(questions, batch_size=1000)
+        questions = Question.objects.filter(user__in=users).order_by('id')
+        self.spread_over_days(
+            questions.first().id, questions.last().id, options['days'])
+        questions = list(questions)
+
+        answer = AnswerFactory.build(question=questions[0], user=users[0])
+        answer_html = rendering.render_markdown(answer.answer)
+        batch = []
+        for question in questions:
+            for _ in range(options['answers_per_question']):
+                batch.append(AnswerFactory.build(
+                    question=question, user=rng.choice(users),
+                    rendered_html=answer_html, rendered_version=version))
+            if len(batch) >= 1000:
+                Answer.objects.bulk_create(batch)
+                batch = []
+        Answer.objects.bulk_create(batch)
+        return users, questions
+
+    def spread_over_days(self, first_id, last_id, days):
+        """
+        Move questions' created dates back over the last `days` days, a day
+        per contiguous id range, since bulk_create() stamps them all now.
+        """
+        now = timezone.now()
+        ranges = split_range(first_id, last_id, days)
+        for offset, (start_after, stop_at) in enumerate(ranges):
+            created = now - timedelta(days=offset)
+            Question.objects.filter(
+                id__gt=start_after, id__lte=stop_at,
+            ).update(created=created, modified=created)
+
+    def request_question_detail(self, client, rng, questions):
+        return client.get(rng.choice(questions).get_absolute_url())
+
+    request_question_detail_anonymous = request_question_detail
+
+    def request_daily_questions(self, client, rng, questions):
+        day = timezone.localdate(rng.choice(questions).created)
+        return client.get('/daily/{}/{}/{}/'.format(
+            day.year, day.month, day.day))
+
+    def request_search(self, client, rng, questions):
+        words = rng.choice(questions).title.split()
+        return client.get('/q/search', {
+            'q': ' '.join(rng.sample(words, min(2, len(words)))),
+        })
+
+    def request_ask(self, client, rng, questions):
+        return client.post('/ask', {
+            'title': 'Benchmark question',
+            'question': 'How fast is *asking*?',
+            'action': 'SAVE',
+        })
+
+    def request_answer(self, client, rng, questions):
+        question = rng.choice(questions)
+        return client.post('/q/{}/answer'.format(question.id), {
+            'answer': 'As fast as *answering*.',
+            'action': 'SAVE',
+        })
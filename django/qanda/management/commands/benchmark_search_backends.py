@@ -0,0 +1,143 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from qanda.models import Question
+from qanda.service import elasticsearch, search
+from qanda.service.benchmarking import SYLLABLES, percentile
+
+BENCHMARK_INDEX = '{}-benchmark'.format(settings.ES_INDEX)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the latency and relevance of search backends by running the '
+        'same queries against each of them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends', nargs='+', default=[
+                'qanda.service.elasticsearch',
+                'qanda.service.postgres_search',
+            ],
+            help='Search backend modules to compare.')
+        parser.add_argument(
+            '--seed-corpus', type=int, default=0,
+            help='Generate this many questions inside a transaction that is '
+                 'rolled back afterwards, indexed into a scratch ES index. '
+                 'By default existing questions are searched.')
+        parser.add_argument(
+            '--queries', type=int, default=200,
+            help='Number of distinct queries to run.')
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Times each query is run against each backend.')
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='Hits compared for relevance.')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed, so runs are comparable.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if not options['seed_corpus']:
+            questions = list(Question.objects.only('id', 'title').order_by('?')[
+                :options['queries']])
+            self.run(rng, questions, options)
+            return
+        with transaction.atomic():
+            questions = self.seed_corpus(rng, options['seed_corpus'])
+            client = elasticsearch.get_client()
+            # BENCHMARK_INDEX matches the template's ES_INDEX-* pattern.
+            elasticsearch.put_index_template()
+            try:
+                with override_settings(ES_INDEX=BENCHMARK_INDEX):
+                    client.indices.create(index=BENCHMARK_INDEX)
+                    elasticsearch.bulk_index(questions, index=BENCHMARK_INDEX)
+                    client.indices.refresh(index=BENCHMARK_INDEX)
+                    self.run(rng, rng.sample(
+                        questions, min(options['queries'], len(questions))),
+                        options)
+            finally:
+                client.indices.delete(index=BENCHMARK_INDEX, ignore=404)
+                transaction.set_rollback(True)
+
+    def seed_corpus(self, rng, count):
+        user = get_user_model().objects.create_user(
+            username='benchmark-{}'.format(rng.random()))
+        vocabulary = [
+            ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            for _ in range(5000)
+        ]
+        # Zipf-like word frequencies, as in natural language.
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+        def words(n):
+            return ' '.join(rng.choices(vocabulary, weights, k=n))
+        Question.objects.bulk_create(
+            (Question(title=words(6), question=words(80), user=user)
+             for _ in range(count)),
+            batch_size=1000,
+        )
+        return list(Question.objects.filter(user=user).order_by('id'))
+
+    def run(self, rng, questions, options):
+        """
+        Query every backend with words taken from each question's title,
+        recording latency and where that question ranks in the results.
+        """
+        if not questions:
+            self.stdout.write(self.style.WARNING('No questions to query.'))
+            return
+        queries = []
+        for question in questions:
+            words = question.title.split()
+            queries.append((
+                ' '.join(rng.sample(words, min(2, len(words)))), question.id))
+
+        results = {}
+        for path in options['backends']:
+            backend = search.get_backend(path)
+            latencies, reciprocal_ranks, top_ids = [], [], []
+            for query, expected_id in queries:
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    page = backend.search_for_questions(
+                        query, 1, options['top'], None)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                ids = [hit['id'] for hit in page['hits']]
+                top_ids.append(set(ids))
+                reciprocal_ranks.append(
+                    1 / (ids.index(expected_id) + 1)
+                    if expected_id in ids else 0)
+            results[path] = top_ids
+            self.stdout.write(
+                '{}: p50 {:.1f}ms p95 {:.1f}ms p99 {:.1f}ms '
+                'recall@{} {:.2f} MRR {:.2f}'.format(
+                    path,
+                    percentile(latencies, 50),
+                    percentile(latencies, 95),
+                    percentile(latencies, 99),
+                    options['top'],
+                    sum(1 for rr in reciprocal_ranks if rr) / len(queries),
+                    statistics.mean(reciprocal_ranks),
+                ))
+
+        paths = list(results)
+        for i, first in enumerate(paths):
+            for second in paths[i + 1:]:
+                overlaps = [
+                    len(a & b) / len(a | b) if a | b else 1.0
+                    for a, b in zip(results[first], results[second])
+                ]
+                self.stdout.write('Top {} overlap {} / {}: {:.2f}'.format(
+                    options['top'], first, second,
+                    statistics.mean(overlaps)))
@@ -0,0 +1,43 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from qanda.service import elasticsearch, outbox
+
+
+class Command(BaseCommand):
+    help = (
+        'Index questions and answers changed or deleted since the last run '
+        'from the outbox'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.ES_OUTBOX_BATCH_SIZE,
+            help='Outbox entries indexed per bulk request.')
+        parser.add_argument(
+            '--poll-interval', type=float,
+            default=settings.ES_OUTBOX_POLL_INTERVAL,
+            help='Seconds to sleep when the outbox is empty.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the outbox once and exit instead of polling.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        index = elasticsearch.ensure_live_index()
+        if index:
+            self.stdout.write('Created empty index {}.'.format(index))
+        while True:
+            indexed = outbox.drain(batch_size=batch_size)
+            if indexed:
+                self.stdout.write(
+                    'Indexed {} outbox entries, lag {:.1f}s'.format(
+                        indexed, outbox.get_lag()))
+            if indexed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS(
+            'Outbox drained, lag {:.1f}s.'.format(outbox.get_lag())))
@@ -0,0 +1,50 @@
+from django.core.management import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from qanda.service import export
+
+
+def date_argument(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream questions and their answers as JSONL or CSV records that '
+        'import_questions can read back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=export.FORMATS, default='jsonl',
+            help='Output format.')
+        parser.add_argument(
+            '--since', type=date_argument,
+            help='Only questions created on or after this date (YYYY-MM-DD).')
+        parser.add_argument(
+            '--until', type=date_argument,
+            help='Only questions created on or before this date (YYYY-MM-DD).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched per round trip from the database cursor.')
+        parser.add_argument(
+            '--output',
+            help='File to write to instead of stdout.')
+
+    def handle(self, *args, **options):
+        records = export.iter_records(
+            options['since'], options['until'], options['chunk_size'])
+        lines = export.iter_lines(records, options['format'])
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        try:
+            with open(options['output'], 'w', newline='',
+                      encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError as e:
+            raise CommandError(e)
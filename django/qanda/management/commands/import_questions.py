@@ -0,0 +1,264 @@
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from qanda.models import Answer, Question
+from qanda.service import elasticsearch, page_cache, rendering, search_cache
+
+TRUE_VALUES = {'1', 'true', 'yes', 't', 'y'}
+INDEX_CHUNK_SIZE = 500
+
+
+class RawInsertQuerySet(QuerySet):
+    """
+    A queryset whose bulk_create() inserts the values set on the rows, as
+    loading a fixture does, instead of letting auto_now and auto_now_add
+    stamp created and modified with the current time.
+    """
+
+    def _insert(self, *args, **kwargs):
+        kwargs['raw'] = True
+        return super()._insert(*args, **kwargs)
+
+
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_created(value):
+    if not value:
+        return timezone.now()
+    created = parse_datetime(value)
+    if created is None:
+        raise ValueError('Invalid created: {!r}'.format(value))
+    if timezone.is_naive(created):
+        created = timezone.make_aware(created)
+    return created
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import questions and answers from a JSONL or CSV dump, then '
+        'index the imported questions into Elasticsearch'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Dump to import, or - for stdin. Each record has a type '
+                 '(question or answer), a unique key, user, created and '
+                 'text; questions a title; answers a question_key and '
+                 'optionally accepted.')
+        parser.add_argument(
+            '--format', choices=['jsonl', 'csv'],
+            help='Dump format, by default guessed from the file extension.')
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help='Records inserted per transaction.')
+        parser.add_argument(
+            '--defer-rendering', action='store_true',
+            help='Leave Markdown rendering to rerender_markdown.')
+        parser.add_argument(
+            '--skip-index', action='store_true',
+            help='Do not index the imported questions into Elasticsearch.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or (
+            'csv' if options['path'].endswith('.csv') else 'jsonl')
+        self.version = rendering.get_renderer_version()
+        self.defer_rendering = options['defer_rendering']
+        self.totals = {'users': 0, 'questions': 0, 'answers': 0, 'skipped': 0}
+        self.question_ids = set()
+        self.changed_question_ids = set()
+        self.changed_days = set()
+        started = time.perf_counter()
+        stream = (
+            sys.stdin if options['path'] == '-'
+            else open(options['path'], newline='', encoding='utf-8'))
+        try:
+            records = read_records(stream, fmt)
+            while True:
+                batch = list(islice(records, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    self.import_batch(batch)
+                self.invalidate_pages()
+                self.report(started)
+        except KeyError as e:
+            raise CommandError('Record in {} is missing {}'.format(
+                options['path'], e))
+        except (ValueError, csv.Error) as e:
+            raise CommandError('Could not read {}: {}'.format(
+                options['path'], e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        # Imported rows bypassed save(), so nothing invalidated the cache.
+        search_cache.bump_generation()
+        if not options['skip_index']:
+            self.index_questions()
+        self.report(started)
+        self.stdout.write(self.style.SUCCESS('Import complete.'))
+
+    def import_batch(self, batch):
+        questions = [r for r in batch if r.get('type') == 'question']
+        answers = [r for r in batch if r.get('type') == 'answer']
+        self.totals['skipped'] += len(batch) - len(questions) - len(answers)
+        users = self.get_users(
+            {r['user'] for r in questions} | {r['user'] for r in answers})
+        question_ids = self.import_questions(questions, users)
+        self.import_answers(answers, users, question_ids)
+
+    def get_users(self, usernames):
+        """
+        Map usernames to user ids, creating users without a usable
+        password for names not seen before.
+        """
+        User = get_user_model()
+        users = dict(User.objects.filter(
+            username__in=usernames).values_list('username', 'id'))
+        missing = usernames - set(users)
+        if missing:
+            password = make_password(None)
+            User.objects.bulk_create(
+                (User(username=name, password=password) for name in missing),
+                ignore_conflicts=True)
+            users.update(User.objects.filter(
+                username__in=missing).values_list('username', 'id'))
+            self.totals['users'] += len(missing)
+        return users
+
+    def import_questions(self, records, users):
+        """
+        Insert the questions whose key isn't imported yet and return the
+        ids of every question in records, by key.
+        """
+        keys = [str(r['key']) for r in records]
+        existing = dict(Question.objects.filter(
+            import_key__in=keys).values_list('import_key', 'id'))
+        new = []
+        for record in records:
+            key = str(record['key'])
+            if key in existing:
+                continue
+            created = parse_created(record.get('created'))
+            new.append(Question(
+                import_key=key,
+                title=record['title'],
+                question=record['text'],
+                user_id=users[record['user']],
+                created=created,
+                modified=created,
+                **self.render(record['text'])
+            ))
+            # Also skips a key repeated within the batch.
+            existing[key] = None
+        RawInsertQuerySet(Question).bulk_create(new, ignore_conflicts=True)
+        self.totals['questions'] += len(new)
+        ids = dict(Question.objects.filter(
+            import_key__in=keys).values_list('import_key', 'id'))
+        for question in new:
+            self.changed_question_ids.add(ids[question.import_key])
+            self.changed_days.add(timezone.localdate(question.created))
+        self.question_ids.update(ids.values())
+        return ids
+
+    def import_answers(self, records, users, question_ids):
+        keys = [str(r['key']) for r in records]
+        existing = set(Answer.objects.filter(
+            import_key__in=keys).values_list('import_key', flat=True))
+        question_keys = {
+            str(r['question_key']) for r in records
+        } - set(question_ids)
+        question_ids = dict(question_ids, **dict(Question.objects.filter(
+            import_key__in=question_keys).values_list('import_key', 'id')))
+        new = []
+        for record in records:
+            key = str(record['key'])
+            question_id = question_ids.get(str(record['question_key']))
+            if question_id is None:
+                self.totals['skipped'] += 1
+                continue
+            self.question_ids.add(question_id)
+            if key in existing:
+                continue
+            created = parse_created(record.get('created'))
+            new.append(Answer(
+                import_key=key,
+                answer=record['text'],
+                question_id=question_id,
+                user_id=users[record['user']],
+                accepted=str(record.get('accepted', '')).lower() in TRUE_VALUES,
+                created=created,
+                modified=created,
+                **self.render(record['text'])
+            ))
+            existing.add(key)
+        RawInsertQuerySet(Answer).bulk_create(new, ignore_conflicts=True)
+        self.totals['answers'] += len(new)
+        self.changed_question_ids.update(answer.question_id for answer in new)
+
+    def invalidate_pages(self):
+        """
+        Bump the cached page versions of the questions and days the last
+        batch changed, since its rows bypassed save().
+        """
+        page_cache.bump(
+            *map(page_cache.question_version_key, self.changed_question_ids),
+            *map(page_cache.day_version_key, self.changed_days))
+        self.changed_question_ids.clear()
+        self.changed_days.clear()
+
+    def render(self, text):
+        if self.defer_rendering:
+            return {}
+        return {
+            'rendered_html': rendering.render_markdown(text),
+            'rendered_version': self.version,
+        }
+
+    def index_questions(self):
+        """
+        Index the questions in the dump and the questions its answers
+        belong to, including ones imported by an earlier run, once the
+        import is done.
+        """
+        if not self.question_ids:
+            return
+        ids = sorted(self.question_ids)
+        failed = 0
+        for start in range(0, len(ids), INDEX_CHUNK_SIZE):
+            chunk = Question.objects.filter(
+                id__in=ids[start:start + INDEX_CHUNK_SIZE]).order_by('id')
+            failed += not elasticsearch.bulk_load(chunk)
+        elasticsearch.refresh_live_index()
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                '{} chunks not indexed successfully. See logged errors.'
+                .format(failed)))
+
+    def report(self, started):
+        elapsed = time.perf_counter() - started
+        rows = self.totals['questions'] + self.totals['answers']
+        self.stdout.write(
+            'Imported {questions} questions, {answers} answers and {users} '
+            'users, skipped {skipped} records'.format(**self.totals)
+            + ' in {:.1f}s ({:.0f} rows/s)'.format(
+                elapsed, rows / elapsed if elapsed else 0))
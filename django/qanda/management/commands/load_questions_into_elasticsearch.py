@@ -1,18 +1,204 @@
-from django.core.management import BaseCommand
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
 
 from qanda.service import elasticsearch
+from qanda.service.keyset import iter_chunks, split_range
 from qanda.models import Question
 
+DEFAULT_CHECKPOINT = 'load_questions_into_elasticsearch.checkpoint'
+
+
+def load_range(range_index, start_after, stop_at, options, progress):
+    """
+    Index the questions with start_after < id <= stop_at and their answers,
+    reporting (range_index, last_id, questions, documents, failed) after
+    every chunk.
+    """
+    chunks = iter_chunks(
+        Question.objects.all(),
+        options['chunk_size'],
+        start_after=start_after,
+        stop_at=stop_at,
+    )
+    for chunk in chunks:
+        documents = elasticsearch.with_answers(chunk)
+        failed_ids = elasticsearch.bulk_index(
+            documents,
+            chunk_size=options['chunk_size'],
+            max_chunk_bytes=options['max_chunk_bytes'],
+            index=options['index'],
+        )
+        progress.put((
+            range_index, chunk[-1].id, len(chunk), len(documents),
+            len(failed_ids)))
+    progress.put((range_index, None, 0, 0, 0))
+
 
 class Command(BaseCommand):
-    help = 'Load all questions into Elasticsearch'
+    help = (
+        'Rebuild the Elasticsearch index into a new versioned index and '
+        'swap the search alias onto it once loaded'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Processes indexing disjoint id ranges in parallel.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Questions fetched and sent per bulk request.')
+        parser.add_argument(
+            '--max-chunk-bytes', type=int, default=10 * 1024 * 1024,
+            help='Upper bound on the size of one bulk request.')
+        parser.add_argument(
+            '--checkpoint', default=DEFAULT_CHECKPOINT,
+            help='File recording progress so an interrupted load resumes.')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Discard an existing checkpoint and the index it was '
+                 'building, and load everything.')
+        parser.add_argument(
+            '--keep-old-indices', action='store_true',
+            help='Keep the previously live index after the alias swap.')
 
     def handle(self, *args, **options):
-        queryset = Question.objects.all()
-        all_loaded = elasticsearch.bulk_load(queryset)
-        if all_loaded:
+        checkpoint = options['checkpoint']
+        if options['restart'] and os.path.exists(checkpoint):
+            self.discard_checkpoint(checkpoint)
+        if not os.path.exists(checkpoint):
+            index = elasticsearch.create_build_index()
+            ranges = self.plan_ranges(options['workers'])
+            failed = 0
+        else:
+            with open(checkpoint) as f:
+                state = json.load(f)
+            index, ranges = state['index'], state['ranges']
+            # Failures of the interrupted run are behind the checkpoint.
+            failed = state.get('failed', 0)
+            self.stdout.write('Resuming from {}'.format(checkpoint))
+        options['index'] = index
+        write_checkpoint(checkpoint, index, ranges, failed)
+
+        failed = self.run(ranges, options, checkpoint, failed)
+
+        elasticsearch.publish_index(
+            index, delete_old=not options['keep_old_indices'])
+        os.remove(checkpoint)
+        if not failed:
             self.stdout.write(self.style.SUCCESS(
-                'Successfully loaded all questions into Elasticsearch.'))
+                'Successfully loaded all questions into {}.'.format(index)))
         else:
             self.stdout.write(self.style.WARNING(
                 'Some questions not loaded successfully. See logged errors.'))
+
+    def discard_checkpoint(self, checkpoint):
+        with open(checkpoint) as f:
+            index = json.load(f)['index']
+        if elasticsearch.delete_build_index(index):
+            self.stdout.write('Deleted {}, left by the discarded load.'.format(
+                index))
+        os.remove(checkpoint)
+
+    def plan_ranges(self, workers):
+        bounds = Question.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            return []
+        return [
+            {'start_after': start_after, 'stop_at': stop_at}
+            for start_after, stop_at
+            in split_range(bounds['first'], bounds['last'], workers)
+        ]
+
+    def run(self, ranges, options, checkpoint, failed):
+        tracker = ProgressTracker(
+            self.stdout, options['index'], ranges, checkpoint, failed)
+        pending = [
+            i for i, r in enumerate(ranges)
+            if r['start_after'] < r['stop_at']
+        ]
+        if len(pending) <= 1:
+            for i in pending:
+                load_range(
+                    i, ranges[i]['start_after'], ranges[i]['stop_at'],
+                    options, tracker)
+            return tracker.failed
+
+        # Children must open their own database connections.
+        connections.close_all()
+        progress = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=load_range, args=(
+                i, ranges[i]['start_after'], ranges[i]['stop_at'],
+                options, progress))
+            for i in pending
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            running = len(workers)
+            while running:
+                try:
+                    report = progress.get(timeout=1)
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        raise CommandError(
+                            'A worker exited early; rerun to resume from '
+                            '{}.'.format(checkpoint))
+                    continue
+                if tracker.put(report):
+                    running -= 1
+        finally:
+            for worker in workers:
+                worker.join()
+        return tracker.failed
+
+
+def write_checkpoint(checkpoint, index, ranges, failed):
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'index': index, 'ranges': ranges, 'failed': failed}, f)
+    os.replace(tmp, checkpoint)
+
+
+class ProgressTracker:
+    """
+    Records per-chunk progress from load_range() in the checkpoint file and
+    reports throughput. Workers send their reports through a queue; a
+    single-process load passes the tracker to load_range() directly.
+    """
+
+    def __init__(self, stdout, index, ranges, checkpoint, failed=0):
+        self.stdout = stdout
+        self.index = index
+        self.ranges = ranges
+        self.checkpoint = checkpoint
+        self.indexed = 0
+        self.documents = 0
+        self.failed = failed
+        self.started = time.monotonic()
+
+    def put(self, report):
+        """
+        Record one report, returning True when it marks a finished range.
+        """
+        range_index, last_id, count, documents, failures = report
+        if last_id is None:
+            return True
+        self.indexed += count
+        self.documents += documents
+        self.failed += failures
+        self.ranges[range_index]['start_after'] = last_id
+        write_checkpoint(
+            self.checkpoint, self.index, self.ranges, self.failed)
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        self.stdout.write(
+            '{} questions and their answers indexed, {:.0f} docs/sec'.format(
+                self.indexed, self.documents / elapsed))
+        return False
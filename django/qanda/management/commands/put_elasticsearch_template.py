@@ -0,0 +1,34 @@
+import json
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from qanda.service import elasticsearch
+
+
+class Command(BaseCommand):
+    help = (
+        'Install the index template (mappings, analyzers and index settings) '
+        'applied to indices built by load_questions_into_elasticsearch'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--print', action='store_true',
+            help='Print the template instead of installing it.')
+
+    def handle(self, *args, **options):
+        if options['print']:
+            self.stdout.write(json.dumps(
+                elasticsearch.get_index_template(), indent=2))
+            return
+        elasticsearch.put_index_template()
+        index = elasticsearch.ensure_live_index()
+        if index:
+            self.stdout.write('Created empty index {} behind {}.'.format(
+                index, settings.ES_INDEX))
+        self.stdout.write(self.style.SUCCESS(
+            'Installed index template {} version {}. Run '
+            'load_questions_into_elasticsearch to rebuild the index with '
+            'it.'.format(
+                settings.ES_INDEX, elasticsearch.INDEX_TEMPLATE_VERSION)))
@@ -0,0 +1,121 @@
+from django.core.management import BaseCommand
+
+from qanda.models import Answer, Question
+from qanda.service import elasticsearch
+from qanda.service.keyset import iter_chunks
+
+RELATIONS = (
+    ('question', Question, ('id', 'created', 'modified')),
+    ('answer', Answer, ('id', 'question', 'created', 'modified')),
+)
+
+
+def iter_row_versions(queryset, chunk_size):
+    """
+    Yield (id, created, modified) for every row of queryset in id order,
+    with the dates formatted the way they are indexed.
+    """
+    for chunk in iter_chunks(queryset, chunk_size):
+        for row in chunk:
+            yield row.id, row.created.isoformat(), row.modified.isoformat()
+
+
+def merge_by_id(rows, documents):
+    """
+    Merge two streams sorted by id into (row, document) pairs, with None
+    on the side an id is missing from.
+    """
+    row = next(rows, None)
+    document = next(documents, None)
+    while row is not None or document is not None:
+        if document is None or (row is not None and row[0] < document[0]):
+            yield row, None
+            row = next(rows, None)
+        elif row is None or document[0] < row[0]:
+            yield None, document
+            document = next(documents, None)
+        else:
+            yield row, document
+            row = next(rows, None)
+            document = next(documents, None)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the search index with the database, deleting documents of '
+        'deleted rows and reindexing missing or stale ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Ids read per query and documents sent per bulk request.')
+        parser.add_argument(
+            '--index',
+            help='Index to reconcile instead of every index taking writes.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report what would be deleted and reindexed.')
+
+    def handle(self, *args, **options):
+        for relation, model, columns in RELATIONS:
+            counts = self.reconcile(
+                relation, model, model.objects.only(*columns), options)
+            self.stdout.write(
+                '{relation}s: {checked} checked, {orphaned} orphaned, '
+                '{missing} missing, {stale} stale, {failed} failed'.format(
+                    relation=relation, **counts))
+        if not options['dry_run']:
+            elasticsearch.refresh_live_index()
+        self.stdout.write(self.style.SUCCESS('Reconciliation done.'))
+
+    def reconcile(self, relation, model, queryset, options):
+        """
+        Walk the rows and documents of one relation side by side, holding
+        at most batch_size pending deletes and reindexes at a time.
+        """
+        batch_size = options['batch_size']
+        counts = dict.fromkeys(
+            ('checked', 'orphaned', 'missing', 'stale', 'failed'), 0)
+        orphans = []
+        reindex = []
+        pairs = merge_by_id(
+            iter_row_versions(queryset, batch_size),
+            elasticsearch.iter_document_versions(
+                relation, index=options['index'], size=batch_size),
+        )
+        for row, document in pairs:
+            counts['checked'] += 1
+            if row is None:
+                counts['orphaned'] += 1
+                orphans.append(document[3:])
+            elif document is None:
+                counts['missing'] += 1
+                reindex.append(row[0])
+            elif row[1:] != document[1:3]:
+                counts['stale'] += 1
+                reindex.append(row[0])
+            if len(orphans) >= batch_size:
+                counts['failed'] += self.delete(orphans, options)
+                orphans = []
+            if len(reindex) >= batch_size:
+                counts['failed'] += self.reindex(model, reindex, options)
+                reindex = []
+        if orphans:
+            counts['failed'] += self.delete(orphans, options)
+        if reindex:
+            counts['failed'] += self.reindex(model, reindex, options)
+        return counts
+
+    def delete(self, orphans, options):
+        if options['dry_run']:
+            return 0
+        return len(elasticsearch.bulk_delete(
+            orphans, chunk_size=options['batch_size'], index=options['index']))
+
+    def reindex(self, model, ids, options):
+        if options['dry_run']:
+            return 0
+        return len(elasticsearch.bulk_index(
+            model.objects.filter(id__in=ids),
+            chunk_size=options['batch_size'], index=options['index']))
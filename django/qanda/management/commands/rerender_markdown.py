@@ -0,0 +1,46 @@
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from qanda.models import Answer, Question
+from qanda.service import page_cache, rendering
+from qanda.service.keyset import iter_chunks
+
+RENDERED_FIELDS = ['modified', 'rendered_html', 'rendered_version']
+
+
+class Command(BaseCommand):
+    help = (
+        'Regenerate the stored HTML of questions and answers rendered by an '
+        'older renderer or MARKDOWNIFY_* configuration'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Rows rendered and written per query.')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Re-render every row, not only stale ones.')
+
+    def handle(self, *args, **options):
+        version = rendering.get_renderer_version()
+        # Touching modified changes the pages' ETag and Last-Modified.
+        now = timezone.now()
+        for model, source_field in ((Question, 'question'), (Answer, 'answer')):
+            queryset = model.objects.only('id', source_field)
+            if not options['all']:
+                queryset = queryset.exclude(rendered_version=version)
+            rendered = 0
+            for chunk in iter_chunks(queryset, options['chunk_size']):
+                for instance in chunk:
+                    instance.rendered_html = rendering.render_markdown(
+                        getattr(instance, source_field))
+                    instance.rendered_version = version
+                    instance.modified = now
+                model.objects.bulk_update(chunk, RENDERED_FIELDS)
+                rendered += len(chunk)
+            self.stdout.write('Rendered {} {} rows.'.format(
+                rendered, model._meta.verbose_name))
+        page_cache.all_changed()
+        self.stdout.write(self.style.SUCCESS(
+            'Stored HTML is up to date with renderer {}.'.format(version)))
@@ -0,0 +1,95 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .service import metrics
+
+slow_request_logger = logging.getLogger('qanda.slow_requests')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+
+class MetricsMiddleware:
+    """
+    Record each request's latency, status and SQL queries by view, and log
+    requests slower than METRICS_SLOW_REQUEST_SECONDS with their slowest
+    queries.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = metrics.begin_request()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(self.record_query))
+                response = self.get_response(request)
+        finally:
+            metrics.end_request()
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        metrics.observe(
+            'answerly_request_seconds', elapsed,
+            view=view, method=request.method)
+        metrics.increment(
+            'answerly_requests_total',
+            view=view, method=request.method, status=response.status_code)
+        metrics.increment(
+            'answerly_sql_queries_total', len(stats.queries), view=view)
+        metrics.increment(
+            'answerly_sql_seconds_total', stats.sql_seconds, view=view)
+        slow = settings.METRICS_SLOW_REQUEST_SECONDS
+        if slow is not None and elapsed >= slow:
+            self.log_slow_request(request, view, elapsed, stats)
+        return response
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - started)
+
+    def log_slow_request(self, request, view, elapsed, stats):
+        slowest = sorted(stats.queries, reverse=True)[
+            :settings.METRICS_SLOW_QUERIES_LOGGED]
+        slow_request_logger.warning(
+            'Slow request %s %s (%s) took %.3fs: %d queries in %.3fs, '
+            'templates %.3fs. Slowest queries:\n%s',
+            request.method, request.get_full_path(), view, elapsed,
+            len(stats.queries), stats.sql_seconds, stats.template_seconds,
+            '\n'.join('%.3fs %s' % query for query in slowest),
+        )
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin a client that just wrote to the primary database for
+    REPLICA_PIN_SECONDS, with a short lived cookie, so replica reads can't
+    hide its own question, answer or acceptance from it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (settings.REPLICA_DATABASES
+                and request.method not in SAFE_METHODS
+                and response.status_code < 400):
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        return response
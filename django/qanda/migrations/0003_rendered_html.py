@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qanda', '0002_index_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='rendered_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='rendered_version',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='rendered_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='rendered_version',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qanda', '0003_rendered_html'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['question', 'created', 'id'], name='qanda_answer_question_created'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:55
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_to_modified(apps, schema_editor):
+    for model_name in ('Question', 'Answer'):
+        model = apps.get_model('qanda', model_name)
+        model.objects.update(modified=F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qanda', '0004_answer_question_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(
+            copy_created_to_modified, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:57
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Must use the same configuration as settings.SEARCH_CONFIG; changing the
+# setting requires a migration that replaces this function and recomputes
+# search_vector.
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('pg_catalog.english', coalesce({0}title, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({0}question, '')), 'B')
+"""
+
+CREATE_SQL = [
+    """
+    CREATE FUNCTION qanda_question_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """.format(SEARCH_VECTOR_SQL.format('NEW.')),
+    """
+    CREATE TRIGGER qanda_question_search_vector
+    BEFORE INSERT OR UPDATE OF title, question, search_vector
+    ON qanda_question
+    FOR EACH ROW EXECUTE PROCEDURE qanda_question_search_vector()
+    """,
+    "UPDATE qanda_question SET search_vector = {}".format(
+        SEARCH_VECTOR_SQL.format('')),
+    """
+    CREATE INDEX qanda_question_search_vector_gin
+    ON qanda_question USING gin (search_vector)
+    """,
+]
+
+DROP_SQL = [
+    "DROP INDEX IF EXISTS qanda_question_search_vector_gin",
+    "DROP TRIGGER IF EXISTS qanda_question_search_vector ON qanda_question",
+    "DROP FUNCTION IF EXISTS qanda_question_search_vector()",
+]
+
+
+def run_on_postgresql(statements):
+    """
+    The trigger and GIN index only exist on PostgreSQL; other databases get
+    the plain column and can't use the postgres_search backend.
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qanda', '0005_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            run_on_postgresql(CREATE_SQL), run_on_postgresql(DROP_SQL)),
+    ]
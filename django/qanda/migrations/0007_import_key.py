@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qanda', '0006_question_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='import_key',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='import_key',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('qanda', '0007_import_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexoutboxentry',
+            name='answer_id',
+            field=models.IntegerField(null=True),
+        ),
+    ]
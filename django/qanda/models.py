@@ -1,8 +1,42 @@
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.urls.base import reverse
+from django.utils import timezone
+
+from .service import page_cache, rendering
+
+
+def render_markdown_fields(instance, source_field, update_fields):
+    """
+    Store the sanitized HTML of instance's Markdown source_field, unless
+    update_fields shows the source is not being saved. Returns the
+    update_fields to save with, which always include modified since the
+    page validators and the search document version are derived from it.
+    """
+    if update_fields is not None:
+        update_fields = set(update_fields) | {'modified'}
+        if source_field not in update_fields:
+            return update_fields
+    instance.rendered_html = rendering.render_markdown(
+        getattr(instance, source_field))
+    instance.rendered_version = rendering.get_renderer_version()
+    if update_fields is not None:
+        update_fields |= {'rendered_html', 'rendered_version'}
+    return update_fields
+
+
+def invalidate_pages(changed, instance, using):
+    """
+    Bump the cached page versions affected by instance now, and again once
+    the transaction commits so a page re-rendered before the commit can't
+    outlive it.
+    """
+    changed(instance)
+    transaction.on_commit(lambda: changed(instance), using=using)
 
-from .service import elasticsearch
 
 class Question(models.Model):
     title = models.CharField(max_length=140)
@@ -11,7 +45,16 @@ class Question(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    modified = models.DateTimeField(auto_now=True)
+    rendered_html = models.TextField(blank=True, editable=False)
+    rendered_version = models.CharField(
+        max_length=12, blank=True, editable=False)
+    # Maintained by a database trigger on PostgreSQL, see migration 0006.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Key of the source record for rows created by import_questions.
+    import_key = models.CharField(
+        max_length=64, null=True, unique=True, editable=False)
 
     def __str__(self):
         return self.title
@@ -20,13 +63,31 @@ class Question(models.Model):
         return {
             '_id': self.id,
             '_type': 'doc',
-            'text': '{}\n{}'.format(self.title, self.question),
+            'relation': 'question',
             'question_body': self.question,
             'title': self.title,
+            'title_suggest': self.get_title_suggest_inputs(),
             'id': self.id,
+            'user_id': self.user_id,
             'created': self.created,
+            'modified': self.modified,
         }
 
+    @property
+    def document_id(self):
+        return str(self.id)
+
+    def get_title_suggest_inputs(self):
+        """
+        The title and its word suffixes, so typeahead prefixes match from
+        the start of any of the first TYPEAHEAD_MAX_INPUTS words.
+        """
+        words = self.title.split()
+        return [
+            ' '.join(words[i:])
+            for i in range(min(len(words), settings.TYPEAHEAD_MAX_INPUTS))
+        ]
+
     def get_absolute_url(self):
         return reverse('qanda:question_detail', kwargs={'pk': self.id})
 
@@ -35,11 +96,17 @@ class Question(models.Model):
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        super().save(force_insert=force_insert,
-                     force_update=force_update,
-                     using=using,
-                     update_fields=update_fields)
-        elasticsearch.upsert(self)
+        update_fields = render_markdown_fields(self, 'question', update_fields)
+        # The outbox row commits (or rolls back) with the question; the
+        # drain_elasticsearch_outbox worker does the actual indexing and
+        # invalidates cached search results once the change is searchable.
+        with transaction.atomic(using=using):
+            super().save(force_insert=force_insert,
+                         force_update=force_update,
+                         using=using,
+                         update_fields=update_fields)
+            IndexOutboxEntry.objects.using(using).create(question_id=self.id)
+        invalidate_pages(page_cache.question_changed, self, using)
 
 
 class Answer(models.Model):
@@ -54,6 +121,111 @@ class Answer(models.Model):
         on_delete=models.CASCADE
     )
     accepted =  models.BooleanField(default=False)
+    modified = models.DateTimeField(auto_now=True)
+    rendered_html = models.TextField(blank=True, editable=False)
+    rendered_version = models.CharField(
+        max_length=12, blank=True, editable=False)
+    import_key = models.CharField(
+        max_length=64, null=True, unique=True, editable=False)
 
     class Meta:
         ordering = ('-created', )
+        indexes = [
+            models.Index(
+                fields=['question', 'created', 'id'],
+                name='qanda_answer_question_created',
+            ),
+        ]
+
+    def as_elasticsearch_dict(self):
+        # A child of its question's document, so it must be routed to the
+        # question's shard.
+        return {
+            '_id': answer_document_id(self.id),
+            '_type': 'doc',
+            '_routing': self.question_id,
+            'relation': {'name': 'answer', 'parent': self.question_id},
+            'answer_body': self.answer,
+            'accepted': self.accepted,
+            'id': self.id,
+            'question_id': self.question_id,
+            'created': self.created,
+            'modified': self.modified,
+        }
+
+    @property
+    def document_id(self):
+        return answer_document_id(self.id)
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        update_fields = render_markdown_fields(self, 'answer', update_fields)
+        # Only this answer's document is reindexed, not its question.
+        with transaction.atomic(using=using):
+            super().save(force_insert=force_insert,
+                         force_update=force_update,
+                         using=using,
+                         update_fields=update_fields)
+            IndexOutboxEntry.objects.using(using).create(
+                question_id=self.question_id, answer_id=self.id)
+        invalidate_pages(page_cache.answer_changed, self, using)
+
+
+def answer_document_id(answer_id):
+    return 'answer-{}'.format(answer_id)
+
+
+class IndexOutboxEntry(models.Model):
+    question_id = models.IntegerField()
+    # Set when the change is to one of the question's answers.
+    answer_id = models.IntegerField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ('id', )
+
+    @property
+    def document_id(self):
+        """
+        The _id of the Elasticsearch document this entry reindexes.
+        """
+        if self.answer_id is None:
+            return str(self.question_id)
+        return answer_document_id(self.answer_id)
+
+    @property
+    def routing(self):
+        """
+        The routing of that document: answers live on their question's
+        shard.
+        """
+        if self.answer_id is None:
+            return None
+        return self.question_id
+
+
+# Deletes, including the ones cascading from a question or user, are
+# recorded in the outbox like saves; drain() finds the row gone and deletes
+# its document. Answers are deleted on their own, since Elasticsearch
+# doesn't cascade from a parent document to its children.
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, using, **kwargs):
+    IndexOutboxEntry.objects.using(using).create(question_id=instance.id)
+    invalidate_pages(page_cache.question_changed, instance, using)
+
+
+@receiver(post_delete, sender=Answer)
+def answer_deleted(sender, instance, using, **kwargs):
+    # Removing the newest answer would otherwise move the question page's
+    # Last-Modified back, and clients holding the page would keep it. The
+    # question's document is reindexed to carry the new modified.
+    Question.objects.using(using).filter(id=instance.question_id).update(
+        modified=timezone.now())
+    IndexOutboxEntry.objects.using(using).bulk_create([
+        IndexOutboxEntry(question_id=instance.question_id),
+        IndexOutboxEntry(
+            question_id=instance.question_id, answer_id=instance.id),
+    ])
+    invalidate_pages(page_cache.answer_changed, instance, using)
@@ -0,0 +1,10 @@
+SYLLABLES = [
+    'ba', 'de', 'fi', 'go', 'ku', 'la', 'me', 'ni', 'po', 'ru',
+    'sa', 'te', 'vi', 'xo', 'zu', 'an', 'el', 'ir', 'on', 'ur',
+]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(int(round(percent / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
@@ -0,0 +1,25 @@
+import base64
+import json
+
+
+def encode(values):
+    """
+    Encode a list of JSON-serializable keyset values as an opaque,
+    URL-safe cursor.
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode(cursor, length):
+    """
+    Decode a cursor made by encode(), raising ValueError unless it holds a
+    list of exactly `length` values.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor: {!r}'.format(cursor))
+    return values
@@ -1,57 +1,609 @@
+import calendar
 import logging
+import os
+import threading
 
 from django.conf import settings
+from django.utils import timezone
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
 from elasticsearch.helpers import streaming_bulk
 
+from qanda.models import Answer
+
+from . import cursors, metrics, search_cache
+from .search import SearchUnavailable, get_created_range
+
 FAILED_TO_LOAD_ERROR = 'Failed to load {}: {!r}'
+FAILED_TO_DELETE_ERROR = 'Failed to delete {}: {!r}'
+SEARCH_SOURCE_FIELDS = ['id', 'title', 'created']
+SEARCH_FIELDS = ['title', 'question_body']
+ANSWER_SEARCH_FIELD = 'answer_body'
+# Bump when get_index_template() changes; indices pick up a new template
+# when they are rebuilt by load_questions_into_elasticsearch.
+INDEX_TEMPLATE_VERSION = 4
 
 logger = logging.getLogger(__name__)
 
+# One client (and so one urllib3 connection pool) is shared by every thread
+# of a process. The owning pid is remembered so a forked child never reuses
+# sockets inherited from its parent.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def _build_client():
+    headers = {}
+    if not settings.ES_KEEP_ALIVE:
+        headers['connection'] = 'close'
+    return Elasticsearch(
+        hosts=[
+            {'host': settings.ES_HOST, 'port': settings.ES_PORT,}
+        ],
+        maxsize=settings.ES_MAXSIZE,
+        timeout=settings.ES_TIMEOUT,
+        max_retries=settings.ES_MAX_RETRIES,
+        retry_on_timeout=settings.ES_RETRY_ON_TIMEOUT,
+        headers=headers,
+    )
+
 def get_client():
-    return Elasticsearch(hosts=[
-         {'host': settings.ES_HOST, 'port': settings.ES_PORT,}
-    ])
+    global _client, _client_lock, _client_pid
+    pid = os.getpid()
+    if _client_pid != pid and _client_pid is not None:
+        # The lock may have been held by another thread at fork time.
+        _client_lock = threading.Lock()
+        _client = None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+                _client_pid = pid
+    return _client
+
+def reset_client():
+    global _client, _client_pid
+    with _client_lock:
+        _client = None
+        _client_pid = None
+
+def get_pool_stats():
+    client = _client
+    if client is None or _client_pid != os.getpid():
+        return []
+    stats = []
+    for connection in client.transport.connection_pool.connections:
+        pool = connection.pool
+        stats.append({
+            'host': connection.host,
+            'maxsize': settings.ES_MAXSIZE,
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+            'reused': max(pool.num_requests - pool.num_connections, 0),
+        })
+    return stats
 
 def bulk_load(questions):
-    all_ok = True
-    es_questions = (q.as_elasticsearch_dict() for q in questions)
+    return not bulk_index(with_answers(questions))
+
+def get_version(modified):
+    """
+    The external version of a document last modified at `modified`: its
+    microseconds since the epoch, so a newer copy always wins.
+    """
+    return int(calendar.timegm(modified.utctimetuple())) * 1000000 + (
+        modified.microsecond)
+
+def with_answers(questions):
+    """
+    questions followed by all of their answers, read in one query.
+    """
+    questions = list(questions)
+    answers = Answer.objects.filter(
+        question_id__in=[q.id for q in questions],
+    ).only(
+        'id', 'question', 'answer', 'accepted', 'created', 'modified',
+    ).order_by()
+    return questions + list(answers)
+
+@metrics.instrument_elasticsearch
+def bulk_index(documents, chunk_size=500, max_chunk_bytes=100 * 1024 * 1024,
+               index=None):
+    """
+    Index questions and answers into `index`, or into every index currently
+    taking writes (see get_write_indices()) when no index is given. The
+    changes aren't searchable until refresh_live_index().
+
+    Documents are versioned by their modified time, so a copy read before
+    a newer one was indexed, such as the loader's while the outbox
+    dual-writes into the index being built, is rejected rather than
+    overwriting it.
+
+    Returns the _ids of the documents that failed to index.
+    """
+    indices = [index] if index else get_write_indices()
+    failed_ids = set()
+    es_documents = (
+        dict(
+            d.as_elasticsearch_dict(),
+            _index=i,
+            _version=get_version(d.modified),
+            _version_type='external_gte',
+        )
+        for d in documents
+        for i in indices
+    )
     for ok, result in streaming_bulk(
         get_client(),
-        es_questions,
-        index=settings.ES_INDEX,
+        es_documents,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
         raise_on_error=False
     ):
-        if not ok:
-            all_ok = False
-            action, result = result.popitem()
+        action, result = result.popitem()
+        # 409: the index already holds a newer version.
+        if not ok and result.get('status') != 409:
+            failed_ids.add(result['_id'])
             logger.error(FAILED_TO_LOAD_ERROR.format(result['_id'], result))
-    return all_ok
+    return sorted(failed_ids)
 
-def search_for_questions(query):
+@metrics.instrument_elasticsearch
+def bulk_delete(documents, chunk_size=500, index=None):
+    """
+    Delete the documents given as (_id, routing) pairs from `index`, or
+    from every index currently taking writes. A document that is already
+    gone counts as deleted. Like bulk_index(), follow with
+    refresh_live_index().
+
+    Deletes are versioned by the current time, so for index.gc_deletes an
+    older copy indexed afterwards can't bring the document back.
+
+    Returns the _ids of the documents that failed to delete.
+    """
+    indices = [index] if index else get_write_indices()
+    failed_ids = set()
+    actions = []
+    version = get_version(timezone.now())
+    for document_id, routing in documents:
+        for i in indices:
+            action = {
+                '_op_type': 'delete',
+                '_index': i,
+                '_type': 'doc',
+                '_id': document_id,
+                '_version': version,
+                '_version_type': 'external_gte',
+            }
+            if routing is not None:
+                action['_routing'] = routing
+            actions.append(action)
+    for ok, result in streaming_bulk(
+        get_client(),
+        actions,
+        chunk_size=chunk_size,
+        raise_on_error=False
+    ):
+        action, result = result.popitem()
+        if not ok and result.get('status') not in (404, 409):
+            failed_ids.add(result['_id'])
+            logger.error(FAILED_TO_DELETE_ERROR.format(result['_id'], result))
+    return sorted(failed_ids)
+
+@metrics.instrument_elasticsearch
+def refresh_live_index():
+    """
+    Make the writes made so far searchable in ES_INDEX, then invalidate the
+    search cache.
+
+    Bumping the generation any earlier would let a search run before the
+    refresh cache the old results for SEARCH_CACHE_TIMEOUT. An index being
+    rebuilt isn't refreshed; it only serves searches once published.
+    """
+    get_client().indices.refresh(index=settings.ES_INDEX)
+    search_cache.bump_generation()
+
+def iter_document_versions(relation, index=None, size=1000):
+    """
+    Yield (id, created, modified, _id, routing) for every `relation`
+    ('question' or 'answer') document in id order.
+
+    Pages are fetched with search_after on id, so memory use is bounded by
+    size however large the index is. created and modified are the ISO 8601
+    strings the documents were indexed with.
+    """
     client = get_client()
-    result = client.search(index=settings.ES_INDEX, body={
-        'query': {
-            'match': {
-                'text': query,
+    body = {
+        'query': {'term': {'relation': relation}},
+        'size': size,
+        'sort': [{'id': 'asc'}],
+        '_source': ['id', 'created', 'modified'],
+    }
+    while True:
+        hits = client.search(
+            index=index or settings.ES_INDEX, body=body)['hits']['hits']
+        for hit in hits:
+            source = hit['_source']
+            yield (
+                source['id'], source.get('created'), source.get('modified'),
+                hit['_id'], hit.get('_routing'),
+            )
+        if len(hits) < size:
+            return
+        body['search_after'] = hits[-1]['sort']
+
+@metrics.instrument_elasticsearch
+def get_alias_indices(alias):
+    response = get_client().indices.get_alias(name=alias, ignore=404)
+    return sorted(
+        index for index, value in response.items()
+        if isinstance(value, dict) and 'aliases' in value
+    )
+
+def get_write_indices():
+    """
+    ES_INDEX, plus the index being rebuilt if a reindex is in progress, so
+    that changes made during a rebuild reach both the live and new index.
+    """
+    return [settings.ES_INDEX] + get_alias_indices(settings.ES_BUILD_ALIAS)
+
+def get_index_template():
+    """
+    The template applied to every versioned index behind ES_INDEX.
+
+    Only title and question_body are analyzed, and searched together as
+    one field by a cross_fields query; id and created are kept for sorting
+    and filtering but id gets no inverted index, nor does modified, which
+    is only read back by reconcile_elasticsearch. Answers are child
+    documents of their question through the `relation` join field, so an
+    answer can be reindexed without touching its question or siblings.
+    """
+    return {
+        'index_patterns': ['{}-*'.format(settings.ES_INDEX)],
+        'version': INDEX_TEMPLATE_VERSION,
+        'settings': {
+            'index': {
+                'number_of_shards': settings.ES_NUMBER_OF_SHARDS,
+                'number_of_replicas': settings.ES_NUMBER_OF_REPLICAS,
+                'refresh_interval': settings.ES_REFRESH_INTERVAL,
+                'codec': 'best_compression',
+            },
+            'analysis': {
+                'filter': {
+                    'english_possessive_stemmer': {
+                        'type': 'stemmer',
+                        'language': 'possessive_english',
+                    },
+                    'english_stemmer': {
+                        'type': 'stemmer',
+                        'language': 'english',
+                    },
+                },
+                'analyzer': {
+                    'answerly_text': {
+                        'type': 'custom',
+                        'tokenizer': 'standard',
+                        'filter': [
+                            'english_possessive_stemmer',
+                            'lowercase',
+                            'asciifolding',
+                            'english_stemmer',
+                        ],
+                    },
+                },
+            },
+        },
+        'mappings': {
+            'doc': {
+                'dynamic': False,
+                'properties': {
+                    'id': {'type': 'integer', 'index': False},
+                    'title': {'type': 'text', 'analyzer': 'answerly_text'},
+                    'question_body': {
+                        'type': 'text',
+                        'analyzer': 'answerly_text',
+                        # Lets the highlighter use the postings instead
+                        # of re-analyzing every hit.
+                        'index_options': 'offsets',
+                    },
+                    'title_suggest': {
+                        'type': 'completion',
+                        'analyzer': 'simple',
+                    },
+                    'created': {'type': 'date'},
+                    'modified': {'type': 'date', 'index': False},
+                    'user_id': {'type': 'integer'},
+                    'relation': {
+                        'type': 'join',
+                        'relations': {'question': 'answer'},
+                    },
+                    'answer_body': {
+                        'type': 'text',
+                        'analyzer': 'answerly_text',
+                    },
+                    'accepted': {'type': 'boolean'},
+                    'question_id': {'type': 'integer'},
+                },
+            },
+        },
+    }
+
+@metrics.instrument_elasticsearch
+def put_index_template():
+    get_client().indices.put_template(
+        name=settings.ES_INDEX, body=get_index_template())
+
+def get_new_index_name():
+    return '{}-{:%Y%m%d%H%M%S}'.format(settings.ES_INDEX, timezone.now())
+
+@metrics.instrument_elasticsearch
+def ensure_live_index():
+    """
+    Create an empty versioned index behind ES_INDEX when nothing by that
+    name exists yet. Otherwise the first write would auto-create a
+    concrete ES_INDEX that the index template doesn't apply to, without
+    the join mapping answers need.
+
+    Returns the new index, or None if ES_INDEX already existed.
+    """
+    client = get_client()
+    if client.indices.exists(index=settings.ES_INDEX):
+        return None
+    put_index_template()
+    index = get_new_index_name()
+    client.indices.create(index=index, body={
+        'aliases': {settings.ES_INDEX: {}},
+    })
+    return index
+
+@metrics.instrument_elasticsearch
+def create_build_index():
+    """
+    Create a new timestamped index from the current index template, tuned
+    for bulk loading, and mark it with ES_BUILD_ALIAS so live writes are
+    dual-written into it.
+    """
+    client = get_client()
+    put_index_template()
+    index = get_new_index_name()
+    client.indices.create(index=index, body={
+        'settings': {
+            'index': {
+                'refresh_interval': '-1',
+                'number_of_replicas': 0,
             },
         },
     })
-    return (h['_source'] for h in result['hits']['hits'])
+    actions = [
+        {'remove': {'index': stale, 'alias': settings.ES_BUILD_ALIAS}}
+        for stale in get_alias_indices(settings.ES_BUILD_ALIAS)
+    ]
+    actions.append({'add': {'index': index, 'alias': settings.ES_BUILD_ALIAS}})
+    client.indices.update_aliases(body={'actions': actions})
+    return index
 
-def upsert(question_model):
+@metrics.instrument_elasticsearch
+def delete_build_index(index):
+    """
+    Delete an index an abandoned load was building, unless ES_INDEX
+    already points at it because that load got as far as publishing it.
+
+    Returns whether the index was deleted.
+    """
+    if index in get_alias_indices(settings.ES_INDEX):
+        return False
+    get_client().indices.delete(index=index, ignore=404)
+    return True
+
+@metrics.instrument_elasticsearch
+def publish_index(index, delete_old=True):
+    """
+    Restore the serving settings of a freshly built index, force-merge it
+    and atomically move the ES_INDEX alias onto it.
+    """
     client = get_client()
-    question_dict = question_model.as_elasticsearch_dict()
-    doc_type = question_dict['_type']
-    del question_dict['_id']
-    del question_dict['_type']
-    response = client.update(
-        settings.ES_INDEX,
-        doc_type,
-        id=question_model.id,
-        body={
-            'doc': question_dict,
-            'doc_as_upsert': True,
+    client.indices.forcemerge(index=index, max_num_segments=1)
+    client.indices.put_settings(index=index, body={
+        'index': {
+            'refresh_interval': settings.ES_REFRESH_INTERVAL,
+            'number_of_replicas': settings.ES_NUMBER_OF_REPLICAS,
+        },
+    })
+    client.indices.refresh(index=index)
+    client.cluster.health(index=index, wait_for_status='yellow')
+    old_indices = get_alias_indices(settings.ES_INDEX)
+    actions = [
+        {'remove': {'index': old, 'alias': settings.ES_INDEX}}
+        for old in old_indices
+    ]
+    if not old_indices and client.indices.exists(index=settings.ES_INDEX):
+        # ES_INDEX is still a concrete index from before aliases were used.
+        actions.append({'remove_index': {'index': settings.ES_INDEX}})
+    actions += [
+        {'add': {'index': index, 'alias': settings.ES_INDEX}},
+        {'remove': {'index': index, 'alias': settings.ES_BUILD_ALIAS}},
+    ]
+    client.indices.update_aliases(body={'actions': actions})
+    search_cache.bump_generation()
+    if delete_old:
+        for old in old_indices:
+            if old != index:
+                client.indices.delete(index=old)
+
+def get_filters(filters):
+    """
+    The filter clauses selecting questions that match filters. They run in
+    filter context, so they don't affect scores and their results are
+    cached by Elasticsearch.
+    """
+    clauses = [{'term': {'relation': 'question'}}]
+    start, end = get_created_range(filters)
+    if start or end:
+        created = {}
+        if start:
+            created['gte'] = start.isoformat()
+        if end:
+            created['lt'] = end.isoformat()
+        clauses.append({'range': {'created': created}})
+    if filters.get('user_id') is not None:
+        clauses.append({'term': {'user_id': filters['user_id']}})
+    if filters.get('has_accepted') is not None:
+        # Acceptance is only stored on the answer, so accepting one never
+        # reindexes its question.
+        has_accepted = {
+            'has_child': {
+                'type': 'answer',
+                'query': {'term': {'accepted': True}},
+            },
         }
-    )
-    return response
+        if filters['has_accepted']:
+            clauses.append(has_accepted)
+        else:
+            clauses.append({'bool': {'must_not': has_accepted}})
+    return clauses
+
+@metrics.instrument_elasticsearch
+def search_for_questions(query, page, size, after, filters=None):
+    """
+    Return one page of hits for query as a dict with `hits`, `total` and
+    `next`, an opaque cursor to pass back as `after` for the following page.
+
+    Pages are addressed with from/size until `after` is given, which
+    switches to search_after so deep pages cost the same as the first.
+    Hits only carry id, title, created and a highlighted `snippet`. The
+    `facets` count every match per month and for the top SEARCH_FACET_SIZE
+    authors.
+
+    A question matches on its own text or on its best matching answer,
+    whose score is multiplied by SEARCH_ACCEPTED_ANSWER_BOOST when it is
+    the accepted one.
+    """
+    client = get_client()
+    answer_query = {
+        'function_score': {
+            'query': {'match': {ANSWER_SEARCH_FIELD: query}},
+            'functions': [{
+                'filter': {'term': {'accepted': True}},
+                'weight': settings.SEARCH_ACCEPTED_ANSWER_BOOST,
+            }],
+        },
+    }
+    body = {
+        'query': {
+            'bool': {
+                'filter': get_filters(filters or {}),
+                'should': [
+                    {
+                        'multi_match': {
+                            'query': query,
+                            'fields': SEARCH_FIELDS,
+                            'type': 'cross_fields',
+                        },
+                    },
+                    {
+                        'has_child': {
+                            'type': 'answer',
+                            'score_mode': 'max',
+                            'query': answer_query,
+                        },
+                    },
+                ],
+                'minimum_should_match': 1,
+            },
+        },
+        'size': size,
+        'sort': [{'_score': 'desc'}, {'id': 'asc'}],
+        '_source': SEARCH_SOURCE_FIELDS,
+        'aggs': {
+            'months': {
+                'date_histogram': {
+                    'field': 'created',
+                    'interval': 'month',
+                    'format': 'yyyy-MM',
+                    'time_zone': timezone.get_current_timezone_name(),
+                    'min_doc_count': 1,
+                },
+            },
+            'authors': {
+                'terms': {
+                    'field': 'user_id',
+                    'size': settings.SEARCH_FACET_SIZE,
+                },
+            },
+        },
+        'highlight': {
+            'encoder': 'html',
+            'require_field_match': False,
+            'pre_tags': ['<mark>'],
+            'post_tags': ['</mark>'],
+            'fields': {
+                'question_body': {
+                    'fragment_size': settings.SEARCH_SNIPPET_SIZE,
+                    'number_of_fragments': 1,
+                    'no_match_size': settings.SEARCH_SNIPPET_SIZE,
+                },
+            },
+        },
+    }
+    if after:
+        body['search_after'] = cursors.decode(after, 2)
+    else:
+        body['from'] = (page - 1) * size
+    try:
+        result = client.search(index=settings.ES_INDEX, body=body)
+    except ESConnectionError as e:
+        raise SearchUnavailable(e)
+    hits = []
+    for h in result['hits']['hits']:
+        hit = h['_source']
+        hit['snippet'] = ''.join(
+            h.get('highlight', {}).get('question_body', []))
+        hits.append(hit)
+    next_cursor = None
+    if len(hits) == size:
+        next_cursor = cursors.encode(result['hits']['hits'][-1]['sort'])
+    aggregations = result['aggregations']
+    return {
+        'hits': hits,
+        'total': result['hits']['total'],
+        'next': next_cursor,
+        'facets': {
+            'months': [
+                {'month': b['key_as_string'], 'count': b['doc_count']}
+                for b in aggregations['months']['buckets']
+            ],
+            'authors': [
+                {'user_id': b['key'], 'count': b['doc_count']}
+                for b in aggregations['authors']['buckets']
+            ],
+        },
+    }
+
+@metrics.instrument_elasticsearch
+def suggest_titles(prefix, size):
+    """
+    Up to size {id, title} suggestions whose title, or a word suffix of
+    it, starts with prefix, from the completion suggester.
+    """
+    client = get_client()
+    try:
+        result = client.search(index=settings.ES_INDEX, body={
+            '_source': ['id', 'title'],
+            'suggest': {
+                'titles': {
+                    'prefix': prefix,
+                    'completion': {
+                        'field': 'title_suggest',
+                        'size': size,
+                    },
+                },
+            },
+        })
+    except ESConnectionError as e:
+        raise SearchUnavailable(e)
+    suggestions = []
+    seen = set()
+    for option in result['suggest']['titles'][0]['options']:
+        if option['_source']['id'] not in seen:
+            seen.add(option['_source']['id'])
+            suggestions.append(option['_source'])
+    return suggestions
@@ -0,0 +1,110 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from qanda.models import Answer, Question
+
+FORMATS = ('jsonl', 'csv')
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Also the record layout read by import_questions.
+FIELDS = [
+    'type', 'id', 'key', 'question_key', 'user', 'created', 'title', 'text',
+    'accepted',
+]
+
+
+def get_range(since=None, until=None):
+    """
+    Filter kwargs for questions created on the dates since..until, both
+    inclusive, as a datetime range the created index can serve.
+    """
+    filters = {}
+    if since:
+        filters['created__gte'] = timezone.make_aware(
+            datetime.combine(since, time.min))
+    if until:
+        filters['created__lt'] = timezone.make_aware(
+            datetime.combine(until + timedelta(days=1), time.min))
+    return filters
+
+
+def iter_records(since=None, until=None, chunk_size=2000):
+    """
+    Yield each question created in the date range followed by its answers,
+    as flat FIELDS dicts.
+
+    Questions and their answers are read by two cursors in question id
+    order and merged, so memory use doesn't grow with the corpus.
+    """
+    filters = get_range(since, until)
+    questions = Question.objects.filter(**filters).order_by('id').values(
+        'id', 'import_key', 'user__username', 'created', 'title', 'question',
+    ).iterator(chunk_size=chunk_size)
+    answers = Answer.objects.filter(**{
+        'question__' + name: value for name, value in filters.items()
+    }).order_by('question_id', 'id').values(
+        'id', 'import_key', 'question_id', 'user__username', 'created',
+        'answer', 'accepted',
+    ).iterator(chunk_size=chunk_size)
+
+    answer = next(answers, None)
+    for question in questions:
+        question_key = question['import_key'] or 'question:{}'.format(
+            question['id'])
+        yield {
+            'type': 'question',
+            'id': question['id'],
+            'key': question_key,
+            'question_key': None,
+            'user': question['user__username'],
+            'created': question['created'],
+            'title': question['title'],
+            'text': question['question'],
+            'accepted': None,
+        }
+        while answer is not None and answer['question_id'] == question['id']:
+            yield {
+                'type': 'answer',
+                'id': answer['id'],
+                'key': answer['import_key'] or 'answer:{}'.format(
+                    answer['id']),
+                'question_key': question_key,
+                'user': answer['user__username'],
+                'created': answer['created'],
+                'title': None,
+                'text': answer['answer'],
+                'accepted': answer['accepted'],
+            }
+            answer = next(answers, None)
+
+
+class Echo:
+    """
+    A file-like object whose write() returns what it was given, so
+    csv.writer can format lines for a generator.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_lines(records, fmt):
+    """
+    Yield the records serialized as lines of JSONL or CSV.
+    """
+    if fmt == 'csv':
+        writer = csv.DictWriter(Echo(), FIELDS)
+        yield writer.writerow(dict(zip(FIELDS, FIELDS)))
+        for record in records:
+            if isinstance(record['created'], datetime):
+                record['created'] = record['created'].isoformat()
+            yield writer.writerow(record)
+        return
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,67 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from . import cursors
+
+
+def iter_chunks(queryset, chunk_size, start_after=None, stop_at=None):
+    """
+    Yield lists of at most chunk_size objects in primary key order.
+
+    Each chunk is fetched with its own `pk > last_seen` query, so memory use
+    is bounded by chunk_size and the queryset's result cache is never
+    filled, unlike iterating over the queryset itself.
+    """
+    queryset = queryset.order_by('pk')
+    if stop_at is not None:
+        queryset = queryset.filter(pk__lte=stop_at)
+    last_pk = start_after
+    while True:
+        page = queryset
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def split_range(first, last, parts):
+    """
+    Split the inclusive range first..last into at most `parts` disjoint
+    (start_after, stop_at) pairs suitable for iter_chunks().
+    """
+    size = max((last - first + 1 + parts - 1) // parts, 1)
+    ranges = []
+    start = first
+    while start <= last:
+        stop = min(start + size - 1, last)
+        ranges.append((start - 1, stop))
+        start = stop + 1
+    return ranges
+
+
+def created_page(queryset, size, cursor=None):
+    """
+    Return (objects, next_cursor) for one page of queryset, newest first.
+
+    Pages are keyset-paginated over (created, id): cursor encodes the last
+    row of the previous page, so every page is an index range scan no
+    matter how deep it is. next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by('-created', '-id')
+    if cursor:
+        created, pk = cursors.decode(cursor, 2)
+        created = parse_datetime(created) if isinstance(created, str) else None
+        if created is None or not isinstance(pk, int):
+            raise ValueError('Invalid cursor: {!r}'.format(cursor))
+        queryset = queryset.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=pk))
+    objects = list(queryset[:size + 1])
+    next_cursor = None
+    if len(objects) > size:
+        objects = objects[:size]
+        last = objects[-1]
+        next_cursor = cursors.encode([last.created.isoformat(), last.id])
+    return objects, next_cursor
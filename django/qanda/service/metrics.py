@@ -0,0 +1,184 @@
+import functools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Everything recorded is aggregated in the memory of the process serving
+# the request, so each mod_wsgi process reports its own totals.
+METRICS = {
+    'answerly_request_seconds': (
+        'histogram', 'Request latency by view.'),
+    'answerly_requests_total': (
+        'counter', 'Requests by view and status code.'),
+    'answerly_sql_queries_total': (
+        'counter', 'SQL queries run by view.'),
+    'answerly_sql_seconds_total': (
+        'counter', 'Time spent in SQL queries by view.'),
+    'answerly_template_render_seconds': (
+        'histogram', 'Template render time by template.'),
+    'answerly_elasticsearch_seconds': (
+        'histogram', 'Elasticsearch call latency by operation.'),
+    'answerly_elasticsearch_errors_total': (
+        'counter', 'Failed Elasticsearch calls by operation and error.'),
+}
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_request = threading.local()
+
+
+class RequestStats:
+    """
+    What the request being handled on this thread has spent so far.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        _counters[name, _label_key(labels)] += amount
+
+
+def observe(name, value, **labels):
+    key = name, _label_key(labels)
+    buckets = settings.METRICS_BUCKETS
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(buckets), 0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def instrument_elasticsearch(func):
+    """
+    Record the latency and errors of an Elasticsearch service function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        operation = func.__name__
+        try:
+            with timer('answerly_elasticsearch_seconds', operation=operation):
+                return func(*args, **kwargs)
+        except Exception as e:
+            increment(
+                'answerly_elasticsearch_errors_total',
+                operation=operation, error=type(e).__name__)
+            raise
+    return wrapper
+
+
+def begin_request():
+    _request.stats = RequestStats()
+    return _request.stats
+
+
+def end_request():
+    _request.stats = None
+
+
+def get_request_stats():
+    return getattr(_request, 'stats', None)
+
+
+def record_query(sql, seconds):
+    stats = get_request_stats()
+    if stats is not None:
+        stats.sql_seconds += seconds
+        stats.queries.append((seconds, sql))
+
+
+def record_template(template_name, seconds):
+    observe('answerly_template_render_seconds', seconds,
+            template=template_name)
+    stats = get_request_stats()
+    if stats is not None:
+        stats.template_seconds += seconds
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def render_prometheus(gauges=()):
+    """
+    Everything recorded, plus (name, help, [(labels, value)]) gauges, in
+    the Prometheus text exposition format.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: (list(buckets), total, count)
+            for key, (buckets, total, count) in _histograms.items()
+        }
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(
+                        name, _format_labels(labels), _format_value(value)))
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(
+                histograms.items()):
+            if metric != name:
+                continue
+            for bound, bucket_count in zip(settings.METRICS_BUCKETS, buckets):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels + (('le', repr(bound)),)),
+                    bucket_count))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(
+                name, _format_labels(labels), _format_value(total)))
+            lines.append('{}_count{} {}'.format(
+                name, _format_labels(labels), count))
+    for name, help_text, samples in gauges:
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} gauge'.format(name))
+        for labels, value in samples:
+            lines.append('{}{} {}'.format(
+                name, _format_labels(_label_key(labels)),
+                _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')
+                         .replace('\n', '\\n'))
+        for k, v in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value))
@@ -0,0 +1,85 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from elasticsearch import TransportError
+
+from qanda.models import Answer, IndexOutboxEntry, Question
+
+from . import elasticsearch
+
+DRAIN_FAILED_ERROR = 'Failed to index outbox batch: {!r}'
+
+logger = logging.getLogger(__name__)
+
+def get_lag():
+    """
+    Seconds since the oldest change still waiting to be indexed was recorded.
+    """
+    oldest = IndexOutboxEntry.objects.aggregate(oldest=Min('created'))['oldest']
+    if oldest is None:
+        return 0.0
+    return max((timezone.now() - oldest).total_seconds(), 0.0)
+
+def get_backoff(attempts):
+    return min(
+        settings.ES_OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1),
+        settings.ES_OUTBOX_BACKOFF_MAX,
+    )
+
+def drain(batch_size=None):
+    """
+    Index one batch of pending outbox entries.
+
+    Repeated entries for the same question or answer are coalesced into a
+    single bulk action carrying its current state; a change to an answer
+    reindexes only that answer's document. Documents whose row no longer
+    exists are deleted in bulk. Entries whose document failed to index are
+    kept and retried with exponential backoff.
+
+    Returns the number of entries consumed.
+    """
+    batch_size = batch_size or settings.ES_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        entries = list(
+            IndexOutboxEntry.objects
+            .select_for_update(skip_locked=True)
+            .filter(available_at__lte=timezone.now())
+            .order_by('id')[:batch_size]
+        )
+        if not entries:
+            return 0
+        question_ids = {e.question_id for e in entries if e.answer_id is None}
+        answer_ids = {e.answer_id for e in entries if e.answer_id is not None}
+        # Read the documents before get_write_indices() runs in bulk_index()
+        # so a rebuild starting in between still receives these changes.
+        documents = list(Question.objects.filter(id__in=question_ids))
+        documents += Answer.objects.filter(id__in=answer_ids)
+        found = {document.document_id for document in documents}
+        deleted = {
+            entry.document_id: entry.routing
+            for entry in entries if entry.document_id not in found
+        }
+        try:
+            failed_ids = set(elasticsearch.bulk_index(
+                documents, chunk_size=batch_size))
+            if deleted:
+                failed_ids.update(elasticsearch.bulk_delete(
+                    deleted.items(), chunk_size=batch_size))
+            elasticsearch.refresh_live_index()
+        except TransportError as e:
+            logger.error(DRAIN_FAILED_ERROR.format(e))
+            failed_ids = {entry.document_id for entry in entries}
+        done = [e.id for e in entries if e.document_id not in failed_ids]
+        IndexOutboxEntry.objects.filter(id__in=done).delete()
+        now = timezone.now()
+        for entry in entries:
+            if entry.document_id in failed_ids:
+                entry.attempts += 1
+                entry.available_at = now + timedelta(
+                    seconds=get_backoff(entry.attempts))
+                entry.save(update_fields=['attempts', 'available_at'])
+    return len(done)
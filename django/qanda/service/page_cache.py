@@ -0,0 +1,122 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils import timezone
+
+from . import replicas
+
+# Bumped to invalidate every page at once, without clearing a cache that
+# may be shared with other data.
+GLOBAL_VERSION_KEY = 'qanda:page:version'
+QUESTION_VERSION_KEY = 'qanda:page:question:{}:version'
+DAY_VERSION_KEY = 'qanda:page:day:{:%Y-%m-%d}:version'
+PAGE_KEY = 'qanda:page:{}'
+LOCK_KEY = 'qanda:page:{}:lock'
+WAIT_INTERVAL = 0.05
+
+def get_cache():
+    return caches[settings.PAGE_CACHE_ALIAS]
+
+def question_version_key(question_id):
+    return QUESTION_VERSION_KEY.format(question_id)
+
+def day_version_key(day):
+    return DAY_VERSION_KEY.format(day)
+
+def get_version(version_key):
+    cache = get_cache()
+    version = cache.get(version_key)
+    if version is None:
+        # Seed from the clock so a version evicted from the cache never
+        # comes back with a value an old page entry was stored under.
+        cache.add(version_key, int(time.time() * 1000), timeout=None)
+        version = cache.get(version_key, 0)
+    return version
+
+def bump(*version_keys):
+    cache = get_cache()
+    for version_key in version_keys:
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            get_version(version_key)
+
+def all_changed():
+    bump(GLOBAL_VERSION_KEY)
+
+def question_changed(question):
+    """
+    Invalidate the question's own page and its day's listing.
+    """
+    bump(
+        question_version_key(question.id),
+        day_version_key(timezone.localdate(question.created)),
+    )
+
+def answer_changed(answer):
+    bump(question_version_key(answer.question_id))
+
+def get_or_render(version_key, path, render):
+    """
+    Return the cached response for path if it was stored under the current
+    values of version_key and GLOBAL_VERSION_KEY and hasn't expired,
+    otherwise render() it.
+
+    Pages rendered while reading from replicas are never stored.
+
+    Only one worker at a time re-renders a given page. While it does, other
+    workers serve the previous copy, or wait briefly for the new one when
+    there is none, instead of all rendering the same page at once.
+    """
+    cache = get_cache()
+    version = (get_version(GLOBAL_VERSION_KEY), get_version(version_key))
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    key = PAGE_KEY.format(digest)
+    entry = cache.get(key)
+    if _is_fresh(entry, version):
+        return _to_response(entry)
+
+    lock_key = LOCK_KEY.format(digest)
+    if cache.add(lock_key, 1, timeout=settings.PAGE_CACHE_LOCK_TIMEOUT):
+        try:
+            response = render()
+            # A replica may not have replayed the write that bumped the
+            # version yet, and its copy would then be served as current
+            # until it expires.
+            if response.status_code == 200 and not replicas.reading_replicas():
+                cache.set(key, {
+                    'version': version,
+                    'expires': time.time() + settings.PAGE_CACHE_TIMEOUT,
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                }, settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_GRACE)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        return _to_response(entry, stale=True)
+    deadline = time.time() + settings.PAGE_CACHE_LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        entry = cache.get(key)
+        if _is_fresh(entry, version):
+            return _to_response(entry)
+    return render()
+
+def _is_fresh(entry, version):
+    return (
+        entry is not None
+        and entry['version'] == version
+        and entry['expires'] > time.time()
+    )
+
+def _to_response(entry, stale=False):
+    response = HttpResponse(
+        entry['content'], content_type=entry['content_type'])
+    # Stale copies must not be labelled with the current validators.
+    response.is_stale = stale
+    return response
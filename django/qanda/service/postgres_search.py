@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import (
+    Count, Exists, F, FloatField, Func, OuterRef, Q, TextField, Value,
+)
+from django.db.models.functions import Cast, TruncMonth
+from django.utils.html import escape
+
+from qanda.models import Answer, Question
+
+from . import cursors
+from .search import get_created_range
+
+# ts_headline() does not escape the text around its matches, so matches are
+# marked with control characters and swapped for <mark> after escaping.
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+HEADLINE_OPTIONS = 'StartSel={}, StopSel={}, MaxWords=35, MinWords=15'.format(
+    START_SEL, STOP_SEL)
+
+
+class Headline(Func):
+    function = 'ts_headline'
+    output_field = TextField()
+
+
+def filter_questions(queryset, filters):
+    start, end = get_created_range(filters)
+    if start:
+        queryset = queryset.filter(created__gte=start)
+    if end:
+        queryset = queryset.filter(created__lt=end)
+    if filters.get('user_id') is not None:
+        queryset = queryset.filter(user_id=filters['user_id'])
+    if filters.get('has_accepted') is not None:
+        queryset = queryset.annotate(has_accepted=Exists(
+            Answer.objects.filter(question=OuterRef('pk'), accepted=True),
+        )).filter(has_accepted=filters['has_accepted'])
+    return queryset
+
+
+def get_facets(matches):
+    months = matches.annotate(month=TruncMonth('created')).values(
+        'month').annotate(count=Count('id')).order_by('month')
+    authors = matches.values('user_id').annotate(
+        count=Count('id')).order_by('-count', 'user_id')
+    return {
+        'months': [
+            {'month': row['month'].strftime('%Y-%m'), 'count': row['count']}
+            for row in months
+        ],
+        'authors': list(authors[:settings.SEARCH_FACET_SIZE]),
+    }
+
+
+def search_for_questions(query, page, size, after, filters=None):
+    """
+    Full-text search over the search_vector column kept up to date by the
+    qanda_question_search_vector trigger and served by its GIN index.
+
+    Returns the same shape as the Elasticsearch backend: hits ranked by
+    ts_rank, paged by offset or by an (rank, id) keyset cursor, and facets
+    counted by GROUP BY queries over the same matches.
+    """
+    search_query = SearchQuery(query, config=settings.SEARCH_CONFIG)
+    matches = filter_questions(
+        Question.objects.filter(search_vector=search_query), filters or {})
+    facets = get_facets(matches)
+    # ts_rank() returns a real; as double precision the rank survives the
+    # round trip through the cursor exactly, so `after` compares equal to
+    # the last row instead of returning it again.
+    matches = matches.annotate(
+        rank=Cast(SearchRank(F('search_vector'), search_query), FloatField()),
+    )
+    total = matches.count()
+    if after:
+        rank, pk = cursors.decode(after, 2)
+        matches = matches.filter(Q(rank__lt=rank) | Q(rank=rank, id__gt=pk))
+        offset = 0
+    else:
+        offset = (page - 1) * size
+    rows = matches.annotate(
+        headline=Headline(
+            Value(settings.SEARCH_CONFIG), F('question'), search_query,
+            Value(HEADLINE_OPTIONS)),
+    ).order_by('-rank', 'id').values(
+        'id', 'title', 'created', 'rank', 'headline',
+    )[offset:offset + size]
+    hits = []
+    for row in rows:
+        hits.append({
+            'id': row['id'],
+            'title': row['title'],
+            'created': row['created'],
+            'snippet': escape(row['headline'])
+                .replace(START_SEL, '<mark>')
+                .replace(STOP_SEL, '</mark>'),
+        })
+    next_cursor = None
+    if len(hits) == size:
+        next_cursor = cursors.encode([row['rank'], row['id']])
+    return {
+        'hits': hits,
+        'total': total,
+        'next': next_cursor,
+        'facets': facets,
+    }
@@ -0,0 +1,58 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import bleach
+import markdown
+from django.conf import settings
+from markdownify.templatetags.markdownify import markdownify
+
+# Bump when render_markdown() changes in a way that alters its output.
+RENDERER_REVISION = 1
+
+_previews = OrderedDict()
+_previews_lock = threading.Lock()
+
+def render_markdown(text):
+    return str(markdownify(text))
+
+def render_preview(text):
+    """
+    render_markdown() memoized by the text's hash in a per-process LRU of
+    MARKDOWN_PREVIEW_CACHE_SIZE entries, so re-previewing unchanged text
+    is free.
+    """
+    key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    with _previews_lock:
+        html = _previews.get(key)
+        if html is not None:
+            _previews.move_to_end(key)
+            return html
+    html = render_markdown(text)
+    with _previews_lock:
+        _previews[key] = html
+        while len(_previews) > settings.MARKDOWN_PREVIEW_CACHE_SIZE:
+            _previews.popitem(last=False)
+    return html
+
+def clear_previews():
+    with _previews_lock:
+        _previews.clear()
+
+def get_renderer_version():
+    """
+    A stamp identifying the renderer and its configuration. Stored HTML
+    with a different stamp is regenerated by rerender_markdown.
+    """
+    markdownify_settings = sorted(
+        (name, repr(getattr(settings, name)))
+        for name in dir(settings)
+        if name.startswith('MARKDOWNIFY_')
+    )
+    fingerprint = repr((
+        RENDERER_REVISION,
+        markdown.__version__,
+        bleach.__version__,
+        markdownify_settings,
+    ))
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]
@@ -0,0 +1,138 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+POSTGRESQL_PRIMARY_LSN_SQL = 'SELECT pg_current_wal_lsn()'
+# 0 when the replica has replayed up to the position the primary had just
+# reached, so an idle primary doesn't look like lag; otherwise the seconds
+# since it last replayed a transaction. Comparing with the primary rather
+# than with what the replica received keeps a replica that lost its
+# connection from reporting no lag, and NULL when it never replayed
+# anything.
+POSTGRESQL_LAG_SQL = '''
+SELECT CASE
+    WHEN pg_last_wal_replay_lsn() >= %s::pg_lsn THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+'''
+
+_state = threading.local()
+_lags = {}
+_lags_lock = threading.Lock()
+
+
+@contextmanager
+def replica_reads():
+    """
+    Route reads made inside the block to a replica that is keeping up,
+    see ReplicaRouter.
+    """
+    previous = getattr(_state, 'enabled', False)
+    _state.enabled = True
+    try:
+        yield
+    finally:
+        _state.enabled = previous
+
+
+def reading_replicas():
+    """
+    Whether reads made here may be routed to a replica.
+    """
+    return getattr(_state, 'enabled', False)
+
+
+def is_pinned(request):
+    """
+    Whether the client wrote recently and must read from the primary to
+    see its own write, see ReplicaPinningMiddleware.
+    """
+    return settings.REPLICA_PIN_COOKIE in request.COOKIES
+
+
+def measure_lag(alias):
+    """
+    The replica's replication lag in seconds, or None when it can't be
+    queried or hasn't replayed anything yet.
+    """
+    connection = connections[alias]
+    try:
+        if connection.vendor != 'postgresql':
+            connection.ensure_connection()
+            return 0.0
+        with connections['default'].cursor() as cursor:
+            cursor.execute(POSTGRESQL_PRIMARY_LSN_SQL)
+            primary_lsn = cursor.fetchone()[0]
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_LAG_SQL, [primary_lsn])
+            lag = cursor.fetchone()[0]
+        return None if lag is None else float(lag)
+    except DatabaseError:
+        logger.exception('Could not measure the lag of replica %s', alias)
+        return None
+
+
+def get_lag(alias):
+    """
+    measure_lag(), re-measured at most every REPLICA_LAG_CHECK_INTERVAL
+    seconds per process.
+    """
+    now = time.monotonic()
+    with _lags_lock:
+        measured = _lags.get(alias)
+    if measured is not None and now - measured[0] < (
+            settings.REPLICA_LAG_CHECK_INTERVAL):
+        return measured[1]
+    lag = measure_lag(alias)
+    with _lags_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def get_lags():
+    return {alias: get_lag(alias) for alias in settings.REPLICA_DATABASES}
+
+
+def reset_lags():
+    with _lags_lock:
+        _lags.clear()
+
+
+def choose_replica():
+    """
+    A random replica whose lag is within REPLICA_MAX_LAG, or None to read
+    from the primary.
+    """
+    healthy = [
+        alias for alias, lag in get_lags().items()
+        if lag is not None and lag <= settings.REPLICA_MAX_LAG
+    ]
+    return random.choice(healthy) if healthy else None
+
+
+class ReplicaRouter:
+    """
+    Send reads inside replica_reads() to a replica and everything else,
+    including all writes and migrations, to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not reading_replicas():
+            return None
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,117 @@
+import calendar
+from datetime import date, datetime, time, timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from . import search_cache
+
+
+class SearchUnavailable(Exception):
+    """
+    Raised by a search backend that can't currently answer queries.
+    """
+
+
+def get_backend(path=None):
+    """
+    Import a search backend module, SEARCH_BACKEND by default.
+
+    A backend provides search_for_questions(query, page, size, after,
+    filters), returning a dict with the page's `hits` (id, title, created
+    and an HTML `snippet`), the `total` number of matches, a `next` cursor
+    and `facets`: `months` as [{month: 'YYYY-MM', count}] and `authors` as
+    [{user_id, count}], both over every match. filters may hold since and
+    until dates (see get_created_range()), a user_id and has_accepted.
+    It may also provide suggest_titles(prefix, size), returning a list of
+    {id, title} dicts, to power the typeahead.
+    """
+    return import_module(path or settings.SEARCH_BACKEND)
+
+
+def search_for_questions(query, page=1, size=None, after=None, filters=None):
+    """
+    Search with SEARCH_BACKEND through the search cache, falling back to
+    SEARCH_FALLBACK_BACKEND if the primary backend is unavailable.
+
+    filters may narrow the matches by since and until dates, an author's
+    username and has_accepted. The facets of the results name authors by
+    username and give each month the since and until that select it.
+    """
+    size = size or settings.SEARCH_PAGE_SIZE
+    filters = {
+        name: value for name, value in (filters or {}).items()
+        if value is not None and value != ''
+    }
+    backends = [settings.SEARCH_BACKEND]
+    if settings.SEARCH_FALLBACK_BACKEND:
+        backends.append(settings.SEARCH_FALLBACK_BACKEND)
+    for path in backends:
+        backend = get_backend(path)
+        try:
+            return search_cache.get_or_search(
+                query, (path, page, size, after, sorted(filters.items())),
+                lambda: _search(backend, query, page, size, after, filters))
+        except SearchUnavailable:
+            if path == backends[-1]:
+                raise
+
+
+def _search(backend, query, page, size, after, filters):
+    filters = dict(filters)
+    author = filters.pop('author', None)
+    if author is not None:
+        filters['user_id'] = get_user_model().objects.filter(
+            username=author).values_list('id', flat=True).first()
+        if filters['user_id'] is None:
+            return {
+                'hits': [], 'total': 0, 'next': None,
+                'facets': {'months': [], 'authors': []},
+            }
+    results = backend.search_for_questions(query, page, size, after, filters)
+    facets = results['facets']
+    usernames = dict(get_user_model().objects.filter(
+        id__in=[author['user_id'] for author in facets['authors']],
+    ).values_list('id', 'username'))
+    facets['authors'] = [
+        {'user': usernames[author['user_id']], 'count': author['count']}
+        for author in facets['authors'] if author['user_id'] in usernames
+    ]
+    for month in facets['months']:
+        year, number = map(int, month['month'].split('-'))
+        month['since'] = date(year, number, 1)
+        month['until'] = date(
+            year, number, calendar.monthrange(year, number)[1])
+    return results
+
+
+def get_created_range(filters):
+    """
+    The aware (start, end) datetimes of the since..until dates in filters,
+    both inclusive, with None for an open end.
+    """
+    start = end = None
+    if filters.get('since'):
+        start = timezone.make_aware(
+            datetime.combine(filters['since'], time.min))
+    if filters.get('until'):
+        end = timezone.make_aware(datetime.combine(
+            filters['until'] + timedelta(days=1), time.min))
+    return start, end
+
+
+def suggest_titles(prefix):
+    """
+    Typeahead suggestions for prefix through the search cache, or an empty
+    list when the prefix is too short or the backend has no suggester.
+    """
+    prefix = search_cache.normalize(prefix)[:settings.TYPEAHEAD_MAX_PREFIX]
+    backend = get_backend()
+    if (len(prefix) < settings.TYPEAHEAD_MIN_PREFIX
+            or not hasattr(backend, 'suggest_titles')):
+        return []
+    return search_cache.get_or_search(
+        prefix, (settings.SEARCH_BACKEND, 'typeahead'),
+        lambda: backend.suggest_titles(prefix, settings.TYPEAHEAD_SIZE))
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+GENERATION_KEY = 'qanda:search:generation'
+RESULT_KEY = 'qanda:search:{generation}:{digest}'
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+def get_cache():
+    return caches[settings.SEARCH_CACHE_ALIAS]
+
+def normalize(query):
+    return ' '.join(query.lower().split())
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so a generation evicted from the cache never
+        # comes back with a value unexpired results were stored under.
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+def bump_generation():
+    """
+    Make every cached result stale without flushing the cache; entries for
+    older generations are never read again and age out on their own.
+    """
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        get_generation()
+
+def make_key(query, page):
+    digest = hashlib.sha1(
+        '{}\n{!r}'.format(normalize(query), page).encode('utf-8')
+    ).hexdigest()
+    return RESULT_KEY.format(generation=get_generation(), digest=digest)
+
+def get_or_search(query, page, search):
+    """
+    Return the cached results for query and page, calling search() and
+    caching what it returns on a miss. page may be any value with a
+    stable repr(), such as a tuple of paging parameters.
+    """
+    cache = get_cache()
+    key = make_key(query, page)
+    results = cache.get(key)
+    if results is not None:
+        _count('hits')
+        return results
+    _count('misses')
+    results = search()
+    cache.set(key, results, settings.SEARCH_CACHE_TIMEOUT)
+    return results
+
+def get_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
@@ -1,59 +1,1151 @@
-from datetime import date
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest import skipUnless
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
 from selenium.webdriver.chrome.webdriver import WebDriver
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase, RequestFactory
-from django.utils import formats
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.template import Template
+from django.template.loader import get_template
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import formats, timezone
+from django.utils.http import parse_http_date
 
 from users.factories import UserFactory
 
-from .factories import QuestionFactory
-from .models import Question
+from .factories import AnswerFactory, QuestionFactory
+from .management.commands import (
+    import_questions,
+    load_questions_into_elasticsearch,
+)
+from .models import Answer, IndexOutboxEntry, Question
+from .service import (
+    metrics,
+    replicas,
+    elasticsearch,
+    outbox,
+    page_cache,
+    rendering,
+    search,
+    search_cache,
+)
+from .service.keyset import split_range
 from .views import DailyQuestionListView
 
+NO_AGGREGATIONS = {'months': {'buckets': []}, 'authors': {'buckets': []}}
+NO_FACETS = {'months': [], 'authors': []}
+
+
+class ElasticsearchClientTestCase(TestCase):
+    """
+    Tests the per-process shared Elasticsearch client
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_client_is_shared(self, ElasticsearchMock):
+        first = elasticsearch.get_client()
+        second = elasticsearch.get_client()
+        self.assertIs(first, second)
+        ElasticsearchMock.assert_called_once()
+        kwargs = ElasticsearchMock.call_args[1]
+        self.assertEqual(settings.ES_MAXSIZE, kwargs['maxsize'])
+        self.assertEqual(settings.ES_TIMEOUT, kwargs['timeout'])
+        self.assertEqual(
+            settings.ES_RETRY_ON_TIMEOUT, kwargs['retry_on_timeout'])
+
+    @patch('qanda.service.elasticsearch.os.getpid')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_client_is_rebuilt_after_fork(self, ElasticsearchMock, getpid):
+        ElasticsearchMock.side_effect = lambda **kwargs: object()
+        getpid.return_value = 100
+        parent_client = elasticsearch.get_client()
+        getpid.return_value = 101
+        child_client = elasticsearch.get_client()
+        self.assertIsNot(parent_client, child_client)
+        self.assertEqual(2, ElasticsearchMock.call_count)
+
 
 class QuestionSaveTestCase(TestCase):
     """
     Tests Question.save()
     """
 
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+
     @patch('qanda.service.elasticsearch.Elasticsearch')
-    def test_elasticsearch_upsert_on_save(self, ElasticsearchMock):
+    def test_save_records_outbox_entry_without_calling_elasticsearch(
+            self, ElasticsearchMock):
         user = get_user_model().objects.create_user(
             username='unittest',
             password='unittest123',
         )
-        question_title = 'Unit test'
-        question_body = 'long text here'
         question = Question(
-            title=question_title,
-            question=question_body,
+            title='Unit test',
+            question='long text here',
             user=user,
         )
         question.save()
         self.assertIsNotNone(question.id)
-        self.assertTrue(ElasticsearchMock.called)
-        mock_client = ElasticsearchMock.return_value
-        mock_client.update.assert_called_once_with(
-            settings.ES_INDEX,
-            'doc',
-            id=question.id,
-            body={
-                'doc': {
-                    'text': '{}\n{}'.format(question_title, question_body),
-                    'question_body': question_body,
-                    'title': question_title,
-                    'id': question.id,
-                    'created': question.created,
-                },
-                'doc_as_upsert': True,
+        self.assertFalse(ElasticsearchMock.called)
+        self.assertEqual(
+            [question.id],
+            [e.question_id for e in IndexOutboxEntry.objects.all()]
+        )
+
+
+class OutboxDrainTestCase(TestCase):
+    """
+    Tests qanda.service.outbox.drain()
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_drain_coalesces_updates(self, ElasticsearchMock, streaming_bulk):
+        question = QuestionFactory()
+        question.title = 'Edited'
+        question.save()
+        self.assertEqual(2, IndexOutboxEntry.objects.count())
+        indexed = []
+
+        def fake_streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                indexed.append(action)
+                yield True, {'index': {'_id': action['_id']}}
+        streaming_bulk.side_effect = fake_streaming_bulk
+
+        self.assertEqual(2, outbox.drain())
+        self.assertEqual(1, len(indexed))
+        question.refresh_from_db()
+        self.assertEqual(
+            dict(
+                question.as_elasticsearch_dict(),
+                _index=settings.ES_INDEX,
+                _version=elasticsearch.get_version(question.modified),
+                _version_type='external_gte',
+            ),
+            indexed[0]
+        )
+        self.assertEqual(0, IndexOutboxEntry.objects.count())
+        self.assertEqual(0, outbox.get_lag())
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_cache_is_invalidated_once_changes_are_searchable(
+            self, ElasticsearchMock, streaming_bulk):
+        client = ElasticsearchMock.return_value
+        client.indices.get_alias.return_value = {}
+        streaming_bulk.return_value = []
+        calls = []
+        client.indices.refresh.side_effect = (
+            lambda **kwargs: calls.append(('refresh', kwargs['index'])))
+        generation = search_cache.get_generation()
+        QuestionFactory()
+        self.assertEqual(generation, search_cache.get_generation())
+
+        with patch('qanda.service.search_cache.bump_generation',
+                   side_effect=lambda: calls.append(('bump',))):
+            outbox.drain()
+        self.assertEqual(
+            [('refresh', settings.ES_INDEX), ('bump',)], calls)
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_failed_entries_are_retried_later(
+            self, ElasticsearchMock, streaming_bulk):
+        question = QuestionFactory()
+        streaming_bulk.return_value = [
+            (False, {'index': {'_id': str(question.id), 'status': 500}}),
+        ]
+
+        self.assertEqual(0, outbox.drain())
+        entry = IndexOutboxEntry.objects.get()
+        self.assertEqual(1, entry.attempts)
+        self.assertGreater(entry.available_at, timezone.now())
+        self.assertEqual(0, outbox.drain())
+        self.assertEqual(1, IndexOutboxEntry.objects.get().attempts)
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_older_copies_lose_to_newer_versions(
+            self, ElasticsearchMock, streaming_bulk):
+        question = QuestionFactory()
+        streaming_bulk.return_value = [
+            (False, {'index': {'_id': str(question.id), 'status': 409}}),
+        ]
+        failed = elasticsearch.bulk_index([question], index='answerly-2')
+        self.assertEqual([], failed)
+        action = next(iter(streaming_bulk.call_args[0][1]))
+        self.assertEqual('external_gte', action['_version_type'])
+        newer = elasticsearch.get_version(
+            question.modified + timedelta(microseconds=1))
+        self.assertEqual(newer - 1, action['_version'])
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_answer_changes_reindex_only_that_answer(
+            self, ElasticsearchMock, streaming_bulk):
+        question = QuestionFactory()
+        AnswerFactory(question=question)
+        answer = AnswerFactory(question=question)
+        IndexOutboxEntry.objects.all().delete()
+        answer.accepted = True
+        answer.save(update_fields=['accepted'])
+        indexed = []
+
+        def fake_streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                indexed.append(action)
+                yield True, {'index': {'_id': action['_id']}}
+        streaming_bulk.side_effect = fake_streaming_bulk
+
+        self.assertEqual(1, outbox.drain())
+        self.assertEqual(1, len(indexed))
+        self.assertEqual('answer-{}'.format(answer.id), indexed[0]['_id'])
+        self.assertEqual(question.id, indexed[0]['_routing'])
+        self.assertEqual(
+            {'name': 'answer', 'parent': question.id}, indexed[0]['relation'])
+        self.assertTrue(indexed[0]['accepted'])
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_deletes_are_propagated(self, ElasticsearchMock, streaming_bulk):
+        ElasticsearchMock.return_value.indices.get_alias.return_value = {}
+        answer = AnswerFactory()
+        question = answer.question
+        IndexOutboxEntry.objects.all().delete()
+        question.user.delete()
+        self.assertEqual(
+            {str(question.id), 'answer-{}'.format(answer.id)},
+            {e.document_id for e in IndexOutboxEntry.objects.all()})
+        actions = []
+
+        def fake_streaming_bulk(client, bulk_actions, **kwargs):
+            for action in bulk_actions:
+                actions.append(action)
+                yield False, {'delete': {'_id': action['_id'], 'status': 404}}
+        streaming_bulk.side_effect = fake_streaming_bulk
+
+        # The answer's delete records its question a second time.
+        self.assertEqual(3, outbox.drain())
+        self.assertEqual(
+            [('delete', str(question.id), None),
+             ('delete', 'answer-{}'.format(answer.id), question.id)],
+            sorted(
+                (a['_op_type'], a['_id'], a.get('_routing'))
+                for a in actions))
+        self.assertEqual(0, IndexOutboxEntry.objects.count())
+
+
+class ReconcileElasticsearchTestCase(TestCase):
+    """
+    Tests the reconcile_elasticsearch command
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+
+    @patch('qanda.service.elasticsearch.bulk_delete')
+    @patch('qanda.service.elasticsearch.bulk_index')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_deletes_orphans_and_reindexes_missing_or_stale(
+            self, ElasticsearchMock, bulk_index, bulk_delete):
+        in_sync, stale, missing = QuestionFactory.create_batch(3)
+        documents = [
+            {'_id': str(q.id), '_source': {
+                'id': q.id,
+                'created': created.isoformat(),
+                'modified': q.modified.isoformat(),
+            }, 'sort': [q.id]}
+            for q, created in (
+                (in_sync, in_sync.created),
+                (stale, datetime(2000, 1, 1, tzinfo=timezone.utc)),
+            )
+        ]
+        documents.append({'_id': '999999', '_source': {
+            'id': 999999, 'created': None, 'modified': None,
+        }, 'sort': [999999]})
+
+        def fake_search(index, body):
+            if body['query']['term']['relation'] != 'question':
+                return {'hits': {'hits': []}}
+            after = body.get('search_after', [0])[0]
+            page = [d for d in documents if d['sort'][0] > after]
+            return {'hits': {'hits': page[:body['size']]}}
+        ElasticsearchMock.return_value.search.side_effect = fake_search
+        reindexed = []
+        bulk_index.side_effect = lambda documents, **kwargs: reindexed.extend(
+            d.id for d in documents) or []
+        bulk_delete.return_value = []
+
+        out = io.StringIO()
+        call_command('reconcile_elasticsearch', batch_size=2, stdout=out)
+        self.assertEqual([stale.id, missing.id], sorted(reindexed))
+        bulk_delete.assert_called_once_with(
+            [('999999', None)], chunk_size=2, index=None)
+        self.assertIn(
+            'questions: 4 checked, 1 orphaned, 1 missing, 1 stale',
+            out.getvalue())
+
+
+class IndexAliasTestCase(TestCase):
+    """
+    Tests building and publishing versioned indices behind ES_INDEX
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_writes_go_to_index_being_built(self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.indices.get_alias.return_value = {
+            'answerly-2': {'aliases': {settings.ES_BUILD_ALIAS: {}}},
+        }
+        self.assertEqual(
+            [settings.ES_INDEX, 'answerly-2'],
+            elasticsearch.get_write_indices()
+        )
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_publish_swaps_alias_atomically(self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.indices.get_alias.return_value = {
+            'answerly-1': {'aliases': {settings.ES_INDEX: {}}},
+        }
+        elasticsearch.publish_index('answerly-2')
+        client.indices.update_aliases.assert_called_once_with(body={
+            'actions': [
+                {'remove': {'index': 'answerly-1', 'alias': settings.ES_INDEX}},
+                {'add': {'index': 'answerly-2', 'alias': settings.ES_INDEX}},
+                {'remove': {
+                    'index': 'answerly-2', 'alias': settings.ES_BUILD_ALIAS}},
+            ],
+        })
+        client.indices.delete.assert_called_once_with(index='answerly-1')
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_fresh_install_gets_templated_index_behind_alias(
+            self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.indices.exists.return_value = False
+        index = elasticsearch.ensure_live_index()
+        self.assertTrue(index.startswith(settings.ES_INDEX + '-'))
+        client.indices.put_template.assert_called_once()
+        client.indices.create.assert_called_once_with(index=index, body={
+            'aliases': {settings.ES_INDEX: {}},
+        })
+
+        client.indices.create.reset_mock()
+        client.indices.exists.return_value = True
+        self.assertIsNone(elasticsearch.ensure_live_index())
+        client.indices.create.assert_not_called()
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_build_index_uses_installed_template(self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.indices.get_alias.return_value = {}
+        index = elasticsearch.create_build_index()
+        name, body = (
+            client.indices.put_template.call_args[1]['name'],
+            client.indices.put_template.call_args[1]['body'])
+        self.assertEqual(settings.ES_INDEX, name)
+        self.assertEqual(['{}-*'.format(settings.ES_INDEX)],
+                         body['index_patterns'])
+        self.assertTrue(index.startswith(settings.ES_INDEX + '-'))
+        mapping = body['mappings']['doc']['properties']
+        self.assertEqual('date', mapping['created']['type'])
+        self.assertFalse(mapping['id']['index'])
+        document = QuestionFactory().as_elasticsearch_dict()
+        self.assertNotIn('text', document)
+        self.assertLessEqual(
+            set(document) - {'_id', '_type'}, set(mapping))
+        answer_document = AnswerFactory().as_elasticsearch_dict()
+        self.assertLessEqual(
+            set(answer_document) - {'_id', '_type', '_routing'}, set(mapping))
+        self.assertEqual(
+            {'question': 'answer'}, mapping['relation']['relations'])
+
+    @patch('qanda.service.elasticsearch.streaming_bulk')
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_bulk_load_includes_answers(
+            self, ElasticsearchMock, streaming_bulk):
+        ElasticsearchMock.return_value.indices.get_alias.return_value = {}
+        question = QuestionFactory()
+        answer = AnswerFactory(question=question)
+        AnswerFactory()
+        indexed = []
+
+        def fake_streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                indexed.append(action['_id'])
+                yield True, {'index': {'_id': action['_id']}}
+        streaming_bulk.side_effect = fake_streaming_bulk
+
+        self.assertTrue(elasticsearch.bulk_load([question]))
+        self.assertEqual(
+            [question.id, 'answer-{}'.format(answer.id)], indexed)
+
+
+class SearchCacheTestCase(TestCase):
+    """
+    Tests the search result cache around search_for_questions()
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+        search_cache.get_cache().clear()
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_repeated_queries_are_served_from_cache(self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.search.return_value = {'hits': {'total': 1, 'hits': [
+            {'_source': {'id': 1, 'title': 'Cached'}, 'sort': [1.0, 1]},
+        ]}, 'aggregations': NO_AGGREGATIONS}
+        stats = search_cache.get_stats()
+        first = search.search_for_questions('Django  ORM')
+        second = search.search_for_questions('django orm')
+        self.assertEqual(
+            [{'id': 1, 'title': 'Cached', 'snippet': ''}], first['hits'])
+        self.assertEqual(first, second)
+        self.assertEqual(1, client.search.call_count)
+        new_stats = search_cache.get_stats()
+        self.assertEqual(stats['hits'] + 1, new_stats['hits'])
+        self.assertEqual(stats['misses'] + 1, new_stats['misses'])
+
+    def test_evicted_generation_does_not_revive_old_results(self):
+        with patch('qanda.service.search_cache.time.time', return_value=1000):
+            search_cache.bump_generation()
+            generation = search_cache.get_generation()
+        search_cache.get_cache().delete(search_cache.GENERATION_KEY)
+        with patch('qanda.service.search_cache.time.time', return_value=1001):
+            self.assertGreater(search_cache.get_generation(), generation)
+        self.assertEqual(1000000, generation)
+
+
+class SearchViewTestCase(TestCase):
+    """
+    Tests the SearchView and the paging of search_for_questions()
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+        search_cache.get_cache().clear()
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_renders_highlighted_snippets_and_next_page(
+            self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.search.return_value = {'hits': {'total': 30, 'hits': [
+            {
+                '_source': {'id': i, 'title': 'Hit {}'.format(i)},
+                'highlight': {'question_body': ['a <mark>match</mark>']},
+                'sort': [1.5, i],
             }
+            for i in range(1, settings.SEARCH_PAGE_SIZE + 1)
+        ]}, 'aggregations': NO_AGGREGATIONS}
+        response = self.client.get('/q/search', {'q': 'match'})
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, '<div>a <mark>match</mark></div>')
+        body = client.search.call_args[1]['body']
+        self.assertEqual(['id', 'title', 'created'], body['_source'])
+        self.assertEqual(0, body['from'])
+        has_child = body['query']['bool']['should'][1]['has_child']
+        self.assertEqual('answer', has_child['type'])
+        self.assertEqual(
+            settings.SEARCH_ACCEPTED_ANSWER_BOOST,
+            has_child['query']['function_score']['functions'][0]['weight'])
+
+        next_after = response.context['next_after']
+        self.client.get(
+            '/q/search', {'q': 'match', 'page': 2, 'after': next_after})
+        body = client.search.call_args[1]['body']
+        self.assertEqual([1.5, settings.SEARCH_PAGE_SIZE], body['search_after'])
+        self.assertNotIn('from', body)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_filters_run_in_filter_context_and_facets_are_rendered(
+            self, ElasticsearchMock):
+        author = UserFactory(username='faceted')
+        client = ElasticsearchMock.return_value
+        client.search.return_value = {
+            'hits': {'total': 0, 'hits': []},
+            'aggregations': {
+                'months': {'buckets': [
+                    {'key_as_string': '2018-02', 'doc_count': 3},
+                ]},
+                'authors': {'buckets': [{'key': author.id, 'doc_count': 3}]},
+            },
+        }
+        response = self.client.get('/q/search', {
+            'q': 'match', 'since': '2018-01-01', 'until': '2018-12-31',
+            'author': 'faceted', 'has_accepted': 'true',
+        })
+        self.assertEqual(200, response.status_code)
+        body = client.search.call_args[1]['body']
+        clauses = body['query']['bool']['filter']
+        self.assertIn({'term': {'relation': 'question'}}, clauses)
+        self.assertIn({'term': {'user_id': author.id}}, clauses)
+        created = next(c for c in clauses if 'range' in c)['range']['created']
+        self.assertTrue(created['gte'].startswith('2018-01-01T00:00:00'))
+        self.assertTrue(created['lt'].startswith('2019-01-01T00:00:00'))
+        self.assertTrue(any('has_child' in c for c in clauses))
+        self.assertEqual(
+            {'months', 'authors'}, set(body['aggs']))
+
+        months = response.context['month_facets']
+        self.assertEqual(date(2018, 2, 1), months[0]['since'])
+        self.assertEqual(date(2018, 2, 28), months[0]['until'])
+        self.assertIn('until=2018-02-28', months[0]['url'])
+        self.assertEqual(
+            [('faceted', 3)],
+            [(a['user'], a['count'])
+             for a in response.context['author_facets']])
+        self.assertContains(response, 'Clear filters')
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_unknown_author_matches_nothing(self, ElasticsearchMock):
+        response = self.client.get(
+            '/q/search', {'q': 'match', 'author': 'nobody'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, response.context['total'])
+        self.assertFalse(ElasticsearchMock.return_value.search.called)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_page_past_result_window_is_not_found(self, ElasticsearchMock):
+        last_page = (settings.SEARCH_MAX_RESULT_WINDOW
+                     // settings.SEARCH_PAGE_SIZE)
+        response = self.client.get(
+            '/q/search', {'q': 'match', 'page': last_page + 1})
+        self.assertEqual(404, response.status_code)
+        self.assertFalse(ElasticsearchMock.return_value.search.called)
+
+    def test_invalid_filter_is_not_found(self):
+        response = self.client.get(
+            '/q/search', {'q': 'match', 'since': 'yesterday'})
+        self.assertEqual(404, response.status_code)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(
+            '/q/search', {'q': 'match', 'after': '!!'})
+        self.assertEqual(404, response.status_code)
+
+
+class TypeaheadViewTestCase(TestCase):
+    """
+    Tests the title typeahead endpoint.
+    """
+
+    def setUp(self):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+        search_cache.get_cache().clear()
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_suggests_titles_and_caches_per_prefix(self, ElasticsearchMock):
+        client = ElasticsearchMock.return_value
+        client.search.return_value = {'suggest': {'titles': [{'options': [
+            {'_source': {'id': 1, 'title': 'How do I sort'}},
+            {'_source': {'id': 1, 'title': 'How do I sort'}},
+            {'_source': {'id': 2, 'title': 'Sorting dicts'}},
+        ]}]}}
+        response = self.client.get('/q/typeahead', {'prefix': ' SOrt '})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            [{'id': 1, 'title': 'How do I sort'},
+             {'id': 2, 'title': 'Sorting dicts'}],
+            response.json()['suggestions'])
+        self.assertIn('max-age=60', response['Cache-Control'])
+        body = client.search.call_args[1]['body']
+        self.assertEqual('sort', body['suggest']['titles']['prefix'])
+
+        self.client.get('/q/typeahead', {'prefix': 'sort'})
+        self.assertEqual(1, client.search.call_count)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_short_prefix_does_not_search(self, ElasticsearchMock):
+        response = self.client.get('/q/typeahead', {'prefix': 's'})
+        self.assertEqual([], response.json()['suggestions'])
+        ElasticsearchMock.return_value.search.assert_not_called()
+
+    def test_suggest_inputs_start_at_each_word(self):
+        question = Question(title='Sorting a  list')
+        self.assertEqual(
+            ['Sorting a list', 'a list', 'list'],
+            question.get_title_suggest_inputs())
+
+
+class SearchBackendTestCase(TestCase):
+    """
+    Tests selecting search backends and falling back between them
+    """
+
+    def setUp(self):
+        search_cache.get_cache().clear()
+
+    @override_settings(SEARCH_FALLBACK_BACKEND='qanda.service.postgres_search')
+    @patch('qanda.service.postgres_search.search_for_questions')
+    @patch('qanda.service.elasticsearch.search_for_questions')
+    def test_falls_back_when_primary_is_unavailable(
+            self, es_search, pg_search):
+        es_search.side_effect = search.SearchUnavailable()
+        pg_search.return_value = {
+            'hits': [], 'total': 0, 'next': None, 'facets': NO_FACETS}
+        results = search.search_for_questions('django')
+        self.assertEqual(pg_search.return_value, results)
+        pg_search.assert_called_once_with(
+            'django', 1, settings.SEARCH_PAGE_SIZE, None, {})
+
+    @patch('qanda.service.elasticsearch.search_for_questions')
+    def test_unavailable_search_is_reported_on_page(self, es_search):
+        es_search.side_effect = search.SearchUnavailable()
+        response = self.client.get('/q/search', {'q': 'django'})
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, 'temporarily unavailable')
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    @override_settings(SEARCH_BACKEND='qanda.service.postgres_search')
+    def test_postgres_backend_ranks_title_matches_first(self):
+        body_match = QuestionFactory(
+            title='Unrelated', question='How do <b>migrations</b> work?')
+        title_match = QuestionFactory(
+            title='Migrations', question='Squashing migrations')
+        results = search.search_for_questions('migrations')
+        self.assertEqual(
+            [title_match.id, body_match.id],
+            [hit['id'] for hit in results['hits']]
         )
+        self.assertIn('<mark>migrations</mark>',
+                      results['hits'][1]['snippet'])
+        self.assertNotIn('<b>', results['hits'][1]['snippet'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    @override_settings(SEARCH_BACKEND='qanda.service.postgres_search')
+    def test_postgres_backend_cursor_visits_every_match_once(self):
+        questions = QuestionFactory.create_batch(
+            7, title='Cursor', question='paging through matches')
+        seen = []
+        after = None
+        for _ in range(len(questions) + 1):
+            results = search.search_for_questions(
+                'matches', size=2, after=after)
+            seen += [hit['id'] for hit in results['hits']]
+            after = results['next']
+            if after is None:
+                break
+        self.assertIsNone(after)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(sorted(q.id for q in questions), sorted(seen))
+
+
+class ImportQuestionsTestCase(TestCase):
+    """
+    Tests the import_questions command
+    """
+    records = [
+        {'type': 'question', 'key': 'q1', 'user': 'ada',
+         'created': '2019-03-01T10:00:00+00:00', 'title': 'First',
+         'text': '*one*'},
+        {'type': 'answer', 'key': 'a1', 'question_key': 'q1', 'user': 'bob',
+         'created': '2019-03-02T10:00:00+00:00', 'text': 'yes',
+         'accepted': True},
+        {'type': 'answer', 'key': 'a2', 'question_key': 'missing',
+         'user': 'bob', 'text': 'orphan'},
+        {'type': 'question', 'key': 'q2', 'user': 'bob',
+         'created': '2019-03-03T10:00:00+00:00', 'title': 'Second',
+         'text': 'two'},
+    ]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.path = self.write_dump('dump.jsonl', self.records)
+
+    def write_dump(self, name, records):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        return path
+
+    def run_import(self, path, *args):
+        indexed = []
+
+        def fake_bulk_load(chunk):
+            indexed.extend(q.import_key for q in chunk)
+            return True
+        with patch('qanda.service.elasticsearch.bulk_load',
+                   side_effect=fake_bulk_load), \
+                patch('qanda.service.elasticsearch.refresh_live_index'):
+            call_command(
+                'import_questions', path, '--batch-size', '2', *args,
+                stdout=io.StringIO())
+        return indexed
+
+    def test_imports_with_timestamps_and_indexes_once(self):
+        indexed = self.run_import(self.path)
+        self.assertEqual(['q1', 'q2'], indexed)
+        first = Question.objects.get(import_key='q1')
+        self.assertEqual('First', first.title)
+        self.assertEqual('ada', first.user.username)
+        self.assertEqual(
+            datetime(2019, 3, 1, 10, tzinfo=timezone.utc), first.created)
+        self.assertEqual('<p><em>one</em></p>', first.rendered_html)
+        self.assertFalse(IndexOutboxEntry.objects.exists())
+        answer = Answer.objects.get()
+        self.assertEqual(first, answer.question)
+        self.assertTrue(answer.accepted)
+        self.assertEqual(
+            datetime(2019, 3, 2, 10, tzinfo=timezone.utc), answer.created)
+
+    def test_rerun_is_idempotent(self):
+        self.run_import(self.path)
+        indexed = self.run_import(self.path)
+        self.assertEqual(['q1', 'q2'], indexed)
+        self.assertEqual(2, Question.objects.count())
+        self.assertEqual(1, Answer.objects.count())
+        self.assertEqual(2, get_user_model().objects.count())
+
+    def test_import_invalidates_changed_pages_without_clearing_cache(self):
+        self.run_import(self.path)
+        cache = page_cache.get_cache()
+        cache.clear()
+        url = Question.objects.get(import_key='q2').get_absolute_url()
+        self.client.get(url)
+        cache.set('unrelated', 'kept')
+        self.run_import(self.write_dump('answers.jsonl', [
+            {'type': 'answer', 'key': 'a3', 'question_key': 'q2',
+             'user': 'ada', 'text': 'Imported later'},
+        ]))
+        self.assertContains(self.client.get(url), 'Imported later')
+        self.assertEqual('kept', cache.get('unrelated'))
+
+    def test_answers_to_earlier_imports_are_indexed(self):
+        self.run_import(self.path)
+        indexed = self.run_import(self.write_dump('answers.jsonl', [
+            {'type': 'answer', 'key': 'a3', 'question_key': 'q2',
+             'user': 'ada', 'text': 'Imported later'},
+        ]))
+        self.assertEqual(['q2'], indexed)
+
+    def test_saves_during_import_are_still_timestamped(self):
+        saved = []
+        get_users = import_questions.Command.get_users
+
+        def save_and_get_users(command, usernames):
+            saved.append(QuestionFactory())
+            return get_users(command, usernames)
+        with patch.object(
+                import_questions.Command, 'get_users', save_and_get_users):
+            self.run_import(self.path)
+        saved[0].refresh_from_db()
+        self.assertLess(
+            timezone.now() - saved[0].created, timedelta(minutes=1))
+
+    def test_imports_csv(self):
+        path = self.path.replace('.jsonl', '.csv')
+        fields = ['type', 'key', 'question_key', 'user', 'created', 'title',
+                  'text', 'accepted']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(self.records)
+        self.run_import(path, '--defer-rendering')
+        self.assertEqual(2, Question.objects.count())
+        self.assertTrue(Answer.objects.get().accepted)
+        self.assertEqual(
+            '', Question.objects.get(import_key='q2').rendered_version)
+
+
+class ExportTestCase(TestCase):
+    """
+    Tests exporting questions and answers as JSONL and CSV
+    """
+
+    def setUp(self):
+        self.old = QuestionFactory(title='Old')
+        Question.objects.filter(id=self.old.id).update(
+            created=datetime(2019, 1, 1, 12, tzinfo=timezone.utc))
+        self.question = QuestionFactory(title='New')
+        self.answers = AnswerFactory.create_batch(2, question=self.question)
+        AnswerFactory(question=self.old)
+
+    def test_command_streams_questions_followed_by_answers(self):
+        stdout = io.StringIO()
+        call_command(
+            'export_questions', '--since', str(timezone.localdate()),
+            '--chunk-size', '1', stdout=stdout)
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(
+            [('question', self.question.id)]
+            + [('answer', a.id) for a in self.answers],
+            [(r['type'], r['id']) for r in records])
+        self.assertEqual(
+            'question:{}'.format(self.question.id), records[2]['question_key'])
+
+    def test_export_can_be_imported(self):
+        stdout = io.StringIO()
+        call_command(
+            'export_questions', '--format', 'csv', '--until', '2019-01-01',
+            stdout=stdout)
+        rows = list(csv.DictReader(io.StringIO(stdout.getvalue())))
+        self.assertEqual(['question', 'answer'], [r['type'] for r in rows])
+        Question.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write(stdout.getvalue())
+            f.flush()
+            call_command(
+                'import_questions', f.name, '--skip-index',
+                stdout=io.StringIO())
+        imported = Question.objects.get()
+        self.assertEqual('Old', imported.title)
+        self.assertEqual(2019, imported.created.year)
+        self.assertEqual(1, imported.answer_set.count())
+
+    def test_view_is_staff_only(self):
+        user = UserFactory()
+        self.client.force_login(user)
+        response = self.client.get('/export')
+        self.assertEqual(403, response.status_code)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(
+            '/export', {'format': 'csv', 'since': '2019-01-01',
+                        'until': '2019-01-01'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response['Content-Type'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(3, len(lines))
+
+        response = self.client.get('/export', {'since': 'yesterday'})
+        self.assertEqual(400, response.status_code)
+
+
+class BenchmarkRequestsTestCase(TestCase):
+    """
+    Tests the benchmark_requests command
+    """
+
+    def test_reports_every_endpoint_and_rolls_back(self):
+        stdout = io.StringIO()
+        call_command(
+            'benchmark_requests', '--questions', '12',
+            '--answers-per-question', '3', '--users', '2', '--days', '3',
+            '--requests', '3', '--samples', '2', '--warmup', '1',
+            stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(12, report['meta']['questions'])
+        for endpoint, result in report['endpoints'].items():
+            self.assertLessEqual(
+                set(result['status_codes']), {'200', '302'}, endpoint)
+            self.assertGreater(result['queries']['max'], 0, endpoint)
+        self.assertEqual(
+            {'302': 3}, report['endpoints']['ask']['status_codes'])
+        self.assertFalse(Question.objects.exists())
+
+    def test_requires_a_question(self):
+        with self.assertRaises(CommandError):
+            call_command(
+                'benchmark_requests', '--questions', '0',
+                stdout=io.StringIO())
+
+
+class LoadQuestionsIntoElasticsearchTestCase(TestCase):
+    """
+    Tests the load_questions_into_elasticsearch command
+    """
+    build_index = 'answerly-1'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint = os.path.join(tmp.name, 'checkpoint')
+        self.questions = [QuestionFactory() for _ in range(5)]
+
+    def load(self, bulk_index, **options):
+        indexed = []
+
+        def fake_bulk_index(chunk, index, **kwargs):
+            self.assertEqual(self.build_index, index)
+            indexed.extend(q.id for q in chunk)
+            return []
+        bulk_index.side_effect = fake_bulk_index
+        stdout = options.pop('stdout', io.StringIO())
+        with patch('qanda.service.elasticsearch.create_build_index',
+                   return_value=self.build_index), \
+                patch('qanda.service.elasticsearch.publish_index') as publish:
+            call_command(
+                'load_questions_into_elasticsearch',
+                checkpoint=self.checkpoint,
+                stdout=stdout,
+                **options
+            )
+        publish.assert_called_once_with(self.build_index, delete_old=True)
+        return indexed
+
+    @patch('qanda.service.elasticsearch.bulk_index')
+    def test_loads_in_chunks(self, bulk_index):
+        indexed = self.load(bulk_index, chunk_size=2)
+        self.assertEqual([q.id for q in self.questions], indexed)
+        self.assertEqual(3, bulk_index.call_count)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @patch('qanda.service.elasticsearch.bulk_index')
+    def test_resumes_from_checkpoint(self, bulk_index):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'index': self.build_index, 'ranges': [{
+                'start_after': self.questions[2].id,
+                'stop_at': self.questions[-1].id,
+            }]}, f)
+        indexed = self.load(bulk_index)
+        self.assertEqual([q.id for q in self.questions[3:]], indexed)
+
+    @patch('qanda.service.elasticsearch.bulk_index')
+    def test_failures_before_resuming_are_reported(self, bulk_index):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'index': self.build_index, 'failed': 2, 'ranges': [{
+                'start_after': self.questions[2].id,
+                'stop_at': self.questions[-1].id,
+            }]}, f)
+        out = io.StringIO()
+        self.load(bulk_index, stdout=out)
+        self.assertIn('Some questions not loaded', out.getvalue())
+        self.assertNotIn('Successfully', out.getvalue())
+
+    @patch('qanda.service.elasticsearch.delete_build_index',
+           return_value=True)
+    @patch('qanda.service.elasticsearch.bulk_index')
+    def test_restart_deletes_abandoned_index(
+            self, bulk_index, delete_build_index):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'index': 'answerly-0', 'ranges': []}, f)
+        indexed = self.load(bulk_index, restart=True)
+        delete_build_index.assert_called_once_with('answerly-0')
+        self.assertEqual([q.id for q in self.questions], indexed)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_published_index_is_not_deleted_as_abandoned(
+            self, ElasticsearchMock):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+        client = ElasticsearchMock.return_value
+        client.indices.get_alias.return_value = {
+            'answerly-0': {'aliases': {settings.ES_INDEX: {}}}}
+        self.assertFalse(elasticsearch.delete_build_index('answerly-0'))
+        self.assertTrue(elasticsearch.delete_build_index('answerly-1'))
+        client.indices.delete.assert_called_once_with(
+            index='answerly-1', ignore=404)
+
+    def test_rate_counts_answer_documents(self):
+        stdout = io.StringIO()
+        with patch.object(load_questions_into_elasticsearch.time, 'monotonic',
+                          side_effect=[0, 2]):
+            tracker = load_questions_into_elasticsearch.ProgressTracker(
+                stdout, self.build_index, [{'start_after': 0, 'stop_at': 10}],
+                self.checkpoint)
+            tracker.put((0, 10, 10, 30, 0))
+        self.assertIn(
+            '10 questions and their answers indexed, 15 docs/sec',
+            stdout.getvalue())
+
+    def test_split_range_is_disjoint_and_complete(self):
+        ranges = split_range(1, 10, 3)
+        self.assertEqual([(0, 4), (4, 8), (8, 10)], ranges)
+
+
+class RenderedMarkdownTestCase(TestCase):
+    """
+    Tests the stored HTML rendering of questions and answers
+    """
+
+    def test_save_stores_rendered_html(self):
+        answer = AnswerFactory(answer='*emphasis* <script>alert(1)</script>')
+        self.assertEqual(
+            '<p><em>emphasis</em> &lt;script&gt;alert(1)&lt;/script&gt;</p>',
+            answer.rendered_html
+        )
+        self.assertEqual(
+            rendering.get_renderer_version(), answer.rendered_version)
+        self.assertEqual(
+            '<p>What is a question?</p>', answer.question.rendered_html)
+
+    def test_update_fields_save_touches_modified(self):
+        answer = AnswerFactory()
+        Answer.objects.filter(id=answer.id).update(
+            modified=answer.modified - timedelta(days=1),
+            rendered_html='kept')
+        answer.accepted = True
+        answer.save(update_fields=['accepted'])
+        answer.refresh_from_db()
+        self.assertTrue(answer.accepted)
+        self.assertLess(
+            timezone.now() - answer.modified, timedelta(minutes=1))
+        self.assertEqual('kept', answer.rendered_html)
+
+    def test_rerender_updates_only_stale_rows(self):
+        stale, current = AnswerFactory.create_batch(2)
+        Answer.objects.filter(id=stale.id).update(
+            rendered_html='', rendered_version='old')
+        Answer.objects.filter(id=current.id).update(rendered_html='kept')
+        call_command('rerender_markdown', stdout=io.StringIO())
+        stale.refresh_from_db()
+        current.refresh_from_db()
+        self.assertEqual('<p>This is an answer.</p>', stale.rendered_html)
+        self.assertEqual(
+            rendering.get_renderer_version(), stale.rendered_version)
+        self.assertEqual('kept', current.rendered_html)
+
+    def test_rerender_invalidates_pages_without_clearing_cache(self):
+        cache = page_cache.get_cache()
+        cache.clear()
+        answer = AnswerFactory()
+        Answer.objects.filter(id=answer.id).update(
+            rendered_html='<p>Old HTML</p>', rendered_version='old')
+        url = answer.question.get_absolute_url()
+        self.assertContains(self.client.get(url), 'Old HTML')
+        cache.set('unrelated', 'kept')
+        call_command('rerender_markdown', stdout=io.StringIO())
+        self.assertNotContains(self.client.get(url), 'Old HTML')
+        self.assertEqual('kept', cache.get('unrelated'))
+
+
+class MarkdownPreviewTestCase(TestCase):
+    """
+    Tests the JSON Markdown preview endpoint
+    """
+
+    def setUp(self):
+        rendering.clear_previews()
+        self.addCleanup(rendering.clear_previews)
+        self.client.force_login(UserFactory())
+
+    def test_renders_sanitized_html_once_per_text(self):
+        text = '*emphasis* <script>alert(1)</script>'
+        with patch('qanda.service.rendering.render_markdown',
+                   wraps=rendering.render_markdown) as render_markdown:
+            for _ in range(2):
+                response = self.client.post('/q/preview', {'text': text})
+                self.assertEqual(
+                    '<p><em>emphasis</em> '
+                    '&lt;script&gt;alert(1)&lt;/script&gt;</p>',
+                    response.json()['html'])
+        render_markdown.assert_called_once_with(text)
+
+    @override_settings(MARKDOWN_PREVIEW_CACHE_SIZE=2)
+    def test_cache_evicts_least_recently_used(self):
+        for text in ('one', 'two', 'one', 'three'):
+            rendering.render_preview(text)
+        with patch('qanda.service.rendering.render_markdown') as render:
+            render.return_value = ''
+            rendering.render_preview('one')
+            rendering.render_preview('two')
+        render.assert_called_once_with('two')
+
+    @override_settings(MARKDOWN_PREVIEW_MAX_LENGTH=5)
+    def test_rejects_long_text(self):
+        response = self.client.post('/q/preview', {'text': 'too long'})
+        self.assertEqual(400, response.status_code)
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.post('/q/preview', {'text': 'text'})
+        self.assertEqual(302, response.status_code)
+
+
+class QueryBudgetMixin:
+    """
+    Fails a test when the code under test issues more SQL queries than its
+    declared budget, listing the queries that were run.
+    """
+
+    def assertMaxQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        if len(context) > budget:
+            self.fail('{} queries exceeded the budget of {}:\n{}'.format(
+                len(context),
+                budget,
+                '\n'.join(q['sql'] for q in context.captured_queries),
+            ))
+        return result
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """
+    Tests that page query counts don't grow with the number of rows shown
+    """
+    SIZES = (1, 100, 1000)
+    DETAIL_BUDGET = 4
+    DETAIL_LOGGED_IN_BUDGET = 6
+    DAILY_BUDGET = 4
+
+    def test_question_detail_within_budget(self):
+        for size in self.SIZES:
+            with self.subTest(answers=size):
+                question = QuestionFactory()
+                Answer.objects.bulk_create(
+                    Answer(answer='answer', question=question,
+                           user=question.user)
+                    for _ in range(size)
+                )
+                url = question.get_absolute_url()
+                response = self.assertMaxQueries(
+                    self.DETAIL_BUDGET, self.client.get, url)
+                self.assertEqual(200, response.status_code)
+                self.client.force_login(question.user)
+                self.assertMaxQueries(
+                    self.DETAIL_LOGGED_IN_BUDGET, self.client.get, url)
+                self.client.logout()
+
+    def test_daily_questions_within_budget(self):
+        user = UserFactory()
+        today = timezone.localdate()
+        url = reverse('qanda:daily_questions', kwargs={
+            'year': today.year, 'month': today.month, 'day': today.day})
+        created = 0
+        for size in self.SIZES:
+            with self.subTest(questions=size):
+                Question.objects.bulk_create(
+                    Question(title='title', question='question', user=user)
+                    for _ in range(size - created)
+                )
+                created = size
+                # bulk_create() bypasses the page cache invalidation.
+                page_cache.get_cache().clear()
+                response = self.assertMaxQueries(
+                    self.DAILY_BUDGET, self.client.get, url)
+                self.assertEqual(
+                    size, len(response.context['object_list']))
 
 
 class DailyQuestionListTestCase(TestCase):
@@ -126,6 +1218,419 @@ class QuestionDetailViewTestCase(TestCase):
         self.assertInHTML(question_needle, rendered_content)
 
 
+class AnswerPaginationTestCase(TestCase):
+    """
+    Tests the keyset pagination of answers on the question detail page
+    """
+
+    def setUp(self):
+        page_cache.get_cache().clear()
+
+    @override_settings(ANSWERS_PAGE_SIZE=2)
+    def test_pages_through_answers_with_accepted_answer_pinned(self):
+        question = QuestionFactory()
+        Answer.objects.bulk_create(
+            Answer(answer='answer {}'.format(i), question=question,
+                   user=question.user, accepted=(i == 0))
+            for i in range(6)
+        )
+        accepted = Answer.objects.get(question=question, accepted=True)
+        answers = sorted(
+            Answer.objects.filter(question=question, accepted=False),
+            key=lambda a: (a.created, a.id),
+            reverse=True
+        )
+        url = question.get_absolute_url()
+        seen = []
+        response = self.client.get(url)
+        self.assertEqual(accepted, response.context['answers'][0])
+        seen += response.context['answers'][1:]
+        while response.context['next_answers_after']:
+            response = self.client.get(
+                url, {'after': response.context['next_answers_after']})
+            self.assertNotIn(accepted, response.context['answers'])
+            seen += response.context['answers']
+        self.assertEqual(answers, seen)
+
+    def test_invalid_cursor_is_not_found(self):
+        question = QuestionFactory()
+        response = self.client.get(
+            question.get_absolute_url(), {'after': 'garbage'})
+        self.assertEqual(404, response.status_code)
+
+
+class AnonymousPageCacheTestCase(QueryBudgetMixin, TestCase):
+    """
+    Tests the anonymous page cache of question and daily pages
+    """
+
+    def setUp(self):
+        page_cache.get_cache().clear()
+        self.question = QuestionFactory()
+        self.url = self.question.get_absolute_url()
+
+    def test_repeat_anonymous_request_only_checks_freshness(self):
+        first = self.client.get(self.url)
+        second = self.assertMaxQueries(1, self.client.get, self.url)
+        self.assertEqual(first.content, second.content)
+
+    def test_new_answer_invalidates_question_page(self):
+        self.client.get(self.url)
+        AnswerFactory(question=self.question, answer='Fresh answer')
+        self.assertContains(self.client.get(self.url), 'Fresh answer')
+
+    def test_edited_question_invalidates_day_page(self):
+        today = timezone.localdate(self.question.created)
+        url = reverse('qanda:daily_questions', kwargs={
+            'year': today.year, 'month': today.month, 'day': today.day})
+        self.client.get(url)
+        self.question.title = 'Retitled'
+        self.question.save()
+        self.assertContains(self.client.get(url), 'Retitled')
+
+    def test_logged_in_users_bypass_cache(self):
+        self.client.get(self.url)
+        self.client.force_login(self.question.user)
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+
+    def test_stale_page_is_served_while_another_worker_renders(self):
+        self.client.get(self.url)
+        page_cache.answer_changed(AnswerFactory.build(question=self.question))
+        cache = page_cache.get_cache()
+        with patch.object(cache, 'add', return_value=False):
+            response = self.assertMaxQueries(1, self.client.get, self.url)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ConditionalGetTestCase(QueryBudgetMixin, TestCase):
+    """
+    Tests ETag and Last-Modified handling of question and daily pages
+    """
+
+    def setUp(self):
+        page_cache.get_cache().clear()
+        self.question = QuestionFactory()
+        today = timezone.localdate(self.question.created)
+        self.urls = [
+            self.question.get_absolute_url(),
+            reverse('qanda:daily_questions', kwargs={
+                'year': today.year, 'month': today.month, 'day': today.day}),
+        ]
+
+    def test_matching_etag_gets_not_modified_with_one_query(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.assertMaxQueries(
+                    1, self.client.get, url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(304, response.status_code)
+
+    def test_unmodified_since_gets_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                last_modified = self.client.get(url)['Last-Modified']
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=last_modified)
+                self.assertEqual(304, response.status_code)
+
+    def test_new_answer_changes_question_etag(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        AnswerFactory(question=self.question)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_etag_differs_per_user(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.question.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_deleting_newest_answer_changes_last_modified(self):
+        url = self.urls[0]
+        answer = AnswerFactory(question=self.question)
+        last_modified = self.client.get(url)['Last-Modified']
+        with patch('django.utils.timezone.now', return_value=(
+                answer.modified + timedelta(seconds=2))):
+            answer.delete()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(200, response.status_code)
+        self.assertGreater(
+            parse_http_date(response['Last-Modified']),
+            parse_http_date(last_modified))
+
+    def test_etag_changes_with_csrf_token(self):
+        url = self.urls[0]
+        self.client.force_login(self.question.user)
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        # Logging in again rotates the token embedded in the page's forms.
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'a' * 64
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+
+class ApiTestCase(QueryBudgetMixin, TestCase):
+    """
+    Tests the read-only JSON API
+    """
+
+    def setUp(self):
+        self.question = QuestionFactory(title='API', question='*body*')
+        self.answers = AnswerFactory.create_batch(3, question=self.question)
+
+    def test_question_with_sparse_fields(self):
+        url = '/api/questions/{}'.format(self.question.id)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'fields': 'title,html,user'})
+        self.assertEqual({
+            'title': 'API',
+            'html': '<p><em>body</em></p>',
+            'user': self.question.user.username,
+        }, response.json())
+        select = context.captured_queries[-1]['sql']
+        self.assertIn('"title"', select)
+        self.assertNotIn('"question"', select.split('FROM')[0])
+
+    def test_unknown_field_and_missing_question(self):
+        response = self.client.get(
+            '/api/questions/{}'.format(self.question.id), {'fields': 'x'})
+        self.assertEqual(400, response.status_code)
+        response = self.client.get('/api/questions/0')
+        self.assertEqual(404, response.status_code)
+        self.assertIn('error', response.json())
+
+    def test_answers_are_cursor_paginated(self):
+        url = '/api/questions/{}/answers'.format(self.question.id)
+        response = self.client.get(url, {'size': 2, 'fields': 'id'})
+        page = response.json()
+        self.assertEqual(2, len(page['results']))
+        response = self.client.get(
+            url, {'size': 2, 'fields': 'id', 'after': page['next']})
+        last = response.json()
+        self.assertIsNone(last['next'])
+        self.assertEqual(
+            {a.id for a in self.answers},
+            {r['id'] for r in page['results'] + last['results']})
+        response = self.client.get(url, {'after': '!!'})
+        self.assertEqual(400, response.status_code)
+
+    def test_etag_answers_conditional_requests(self):
+        url = '/api/questions/{}/answers'.format(self.question.id)
+        etag = self.client.get(url)['ETag']
+        response = self.assertMaxQueries(
+            1, self.client.get, url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        AnswerFactory(question=self.question)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+
+    def test_daily_listing(self):
+        today = timezone.localdate()
+        response = self.client.get('/api/daily/{}/{}/{}'.format(
+            today.year, today.month, today.day), {'fields': 'id,title'})
+        self.assertEqual(
+            [{'id': self.question.id, 'title': 'API'}],
+            response.json()['results'])
+
+    @patch('qanda.api.search_for_questions')
+    def test_search(self, search_for_questions):
+        search_for_questions.return_value = {
+            'hits': [{'id': 1, 'title': 'Hit', 'snippet': '<mark>x</mark>'}],
+            'total': 1,
+            'next': None,
+        }
+        response = self.client.get(
+            '/api/search', {'q': 'x', 'fields': 'id,title'})
+        self.assertEqual(
+            [{'id': 1, 'title': 'Hit'}], response.json()['results'])
+        self.assertTrue(response.has_header('ETag'))
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """
+    Tests routing reads to replicas and pinning recent writers to the
+    primary
+    """
+
+    def setUp(self):
+        replicas.reset_lags()
+        self.addCleanup(replicas.reset_lags)
+        self.router = replicas.ReplicaRouter()
+
+    @override_settings(REPLICA_DATABASES=['replica'], REPLICA_MAX_LAG=5)
+    @patch('qanda.service.replicas.measure_lag')
+    def test_reads_use_replica_only_inside_block_and_when_caught_up(
+            self, measure_lag):
+        measure_lag.return_value = 1.0
+        self.assertIsNone(self.router.db_for_read(Question))
+        with replicas.replica_reads():
+            self.assertEqual('replica', self.router.db_for_read(Question))
+            self.assertEqual('default', self.router.db_for_write(Question))
+        replicas.reset_lags()
+        measure_lag.return_value = 30.0
+        with replicas.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Question))
+        replicas.reset_lags()
+        measure_lag.return_value = None
+        with replicas.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Question))
+
+    @patch('qanda.service.replicas.connections')
+    def test_lag_is_measured_against_primary_position(self, connections):
+        primary, replica = MagicMock(), MagicMock(vendor='postgresql')
+        connections.__getitem__.side_effect = {
+            'default': primary, 'replica': replica}.__getitem__
+        primary_cursor = primary.cursor.return_value.__enter__.return_value
+        primary_cursor.fetchone.return_value = ('0/3000060',)
+        replica_cursor = replica.cursor.return_value.__enter__.return_value
+        replica_cursor.fetchone.return_value = (12.5,)
+        self.assertEqual(12.5, replicas.measure_lag('replica'))
+        sql, params = replica_cursor.execute.call_args[0]
+        self.assertIn('pg_last_wal_replay_lsn()', sql)
+        self.assertEqual(['0/3000060'], params)
+        replica_cursor.fetchone.return_value = (None,)
+        self.assertIsNone(replicas.measure_lag('replica'))
+
+    @override_settings(
+        REPLICA_DATABASES=['replica'], REPLICA_LAG_CHECK_INTERVAL=60)
+    @patch('qanda.service.replicas.measure_lag', return_value=0.0)
+    def test_lag_is_measured_once_per_interval(self, measure_lag):
+        for _ in range(3):
+            replicas.get_lag('replica')
+        measure_lag.assert_called_once_with('replica')
+
+    @override_settings(REPLICA_DATABASES=['replica'])
+    @patch('qanda.service.replicas.replica_reads')
+    def test_writer_is_pinned_to_primary(self, replica_reads):
+        question = QuestionFactory()
+        self.client.force_login(UserFactory())
+        self.client.get(question.get_absolute_url())
+        self.assertEqual(1, replica_reads.call_count)
+
+        response = self.client.post(
+            '/q/{}/answer'.format(question.id),
+            {'answer': 'Mine', 'action': 'SAVE'})
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(
+            settings.REPLICA_PIN_SECONDS,
+            response.cookies[settings.REPLICA_PIN_COOKIE]['max-age'])
+        self.client.get(question.get_absolute_url())
+        self.assertEqual(1, replica_reads.call_count)
+
+
+    @override_settings(REPLICA_DATABASES=['replica'])
+    @patch('qanda.service.replicas.replica_reads')
+    def test_cached_pages_are_read_from_primary(self, replica_reads):
+        question = QuestionFactory()
+        self.client.get(question.get_absolute_url())
+        replica_reads.assert_not_called()
+
+    def test_page_rendered_on_replica_after_bump_is_not_cached(self):
+        page_cache.get_cache().clear()
+        key = page_cache.question_version_key(1)
+        render = MagicMock(return_value=HttpResponse('Before the write'))
+        with replicas.replica_reads():
+            page_cache.bump(key)
+            page_cache.get_or_render(key, '/q/1', render)
+            page_cache.get_or_render(key, '/q/1', render)
+        self.assertEqual(2, render.call_count)
+        page_cache.get_or_render(key, '/q/1', render)
+        page_cache.get_or_render(key, '/q/1', render)
+        self.assertEqual(3, render.call_count)
+
+
+class CompressedStaticFilesTestCase(TestCase):
+    """
+    Tests collectstatic with the hashed, precompressed storage
+    """
+
+    def test_collectstatic_writes_hashed_and_gzipped_files(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        with override_settings(
+                STATIC_ROOT=tmp.name,
+                STATICFILES_STORAGE=(
+                    'config.storage.CompressedManifestStaticFilesStorage')):
+            call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(tmp.name, 'staticfiles.json')) as f:
+            hashed = json.load(f)['paths']['typeahead.js']
+        self.assertRegex(hashed, r'^typeahead\.[0-9a-f]{12}\.js$')
+        path = os.path.join(tmp.name, hashed)
+        with open(path, 'rb') as original, \
+                gzip.open(path + '.gz', 'rb') as compressed:
+            self.assertEqual(original.read(), compressed.read())
+
+
+class MetricsTestCase(TestCase):
+    """
+    Tests recording request, SQL, template and Elasticsearch metrics and
+    exposing them
+    """
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_records_views_and_exposes_them_to_scrapers(self):
+        question = QuestionFactory()
+        self.client.get(question.get_absolute_url())
+        self.assertEqual(403, self.client.get('/metrics').status_code)
+        self.assertEqual(403, self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secrex').status_code)
+        response = self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(200, response.status_code)
+        text = response.content.decode()
+        self.assertIn(
+            'answerly_requests_total{method="GET",status="200",'
+            'view="qanda:question_detail"} 1.0', text)
+        self.assertIn(
+            'answerly_request_seconds_count{method="GET",'
+            'view="qanda:question_detail"} 1', text)
+        self.assertRegex(
+            text, r'answerly_sql_queries_total\{view="qanda:question_detail"'
+                  r'\} [1-9]')
+        self.assertIn(
+            'answerly_template_render_seconds_count'
+            '{template="qanda/question_detail.html"} 1', text)
+
+    @patch('qanda.service.elasticsearch.Elasticsearch')
+    def test_records_elasticsearch_latency_and_errors(self, ElasticsearchMock):
+        elasticsearch.reset_client()
+        self.addCleanup(elasticsearch.reset_client)
+        ElasticsearchMock.return_value.search.side_effect = (
+            ESConnectionError('N/A', 'down', None))
+        with self.assertRaises(search.SearchUnavailable):
+            elasticsearch.search_for_questions('q', 1, 10, None)
+        text = metrics.render_prometheus()
+        self.assertIn(
+            'answerly_elasticsearch_errors_total{error="SearchUnavailable",'
+            'operation="search_for_questions"} 1.0', text)
+        self.assertIn(
+            'answerly_elasticsearch_seconds_count'
+            '{operation="search_for_questions"} 1', text)
+
+    @override_settings(METRICS_SLOW_REQUEST_SECONDS=0)
+    def test_logs_slow_requests_with_queries(self):
+        question = QuestionFactory()
+        with self.assertLogs('qanda.slow_requests', 'WARNING') as logs:
+            self.client.get(question.get_absolute_url())
+        self.assertIn('(qanda:question_detail)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_instrumented_templates_pass_attributes_through(self):
+        template = get_template('qanda/search.html')
+        self.assertIsInstance(template.template, Template)
+        self.assertEqual('qanda/search.html', template.template.name)
+
+
 class AskQuestionTestCase(StaticLiveServerTestCase):
     @classmethod
     def setUpClass(cls):
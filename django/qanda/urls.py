@@ -1,6 +1,6 @@
 from django.urls.conf import path
 
-from . import views
+from . import api, views
 
 app_name = 'qanda'
 urlpatterns = [
@@ -19,6 +19,11 @@ urlpatterns = [
          views.AnswerCreateView.as_view(),
          name='answer_question',
     ),
+    path(
+        'q/preview',
+        views.MarkdownPreviewView.as_view(),
+        name='markdown_preview',
+    ),
     path(
         'a/<int:pk>/accept',
         views.AnswerAcceptanceUpdateView.as_view(),
@@ -39,4 +44,44 @@ urlpatterns = [
         views.SearchView.as_view(),
         name='question_search',
     ),
+    path(
+        'export',
+        views.ExportView.as_view(),
+        name='export',
+    ),
+    path(
+        'q/typeahead',
+        views.TypeaheadView.as_view(),
+        name='question_typeahead',
+    ),
+    path(
+        'metrics',
+        views.MetricsView.as_view(),
+        name='metrics',
+    ),
+    path(
+        'api/questions',
+        api.QuestionListApiView.as_view(),
+        name='api_question_list',
+    ),
+    path(
+        'api/questions/<int:pk>',
+        api.QuestionApiView.as_view(),
+        name='api_question',
+    ),
+    path(
+        'api/questions/<int:pk>/answers',
+        api.AnswerListApiView.as_view(),
+        name='api_answer_list',
+    ),
+    path(
+        'api/daily/<int:year>/<int:month>/<int:day>',
+        api.DailyQuestionListApiView.as_view(),
+        name='api_daily_questions',
+    ),
+    path(
+        'api/search',
+        api.SearchApiView.as_view(),
+        name='api_search',
+    ),
 ]
@@ -1,10 +1,26 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
+import hashlib
+import hmac
+from calendar import timegm
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db.models import Count, Max
 from django.http import (
+    Http404,
+    HttpResponse,
     HttpResponseBadRequest,
+    HttpResponseForbidden,
     HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
 )
+from django.middleware.csrf import get_token
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date, quote_etag, urlencode
 from django.views.generic import (
     CreateView,
     DayArchiveView,
@@ -12,15 +28,142 @@ from django.views.generic import (
     RedirectView,
     TemplateView,
     UpdateView,
+    View,
 )
 
 from .forms import (
     AnswerForm,
     AnswerAcceptanceForm,
     QuestionForm,
+    SearchFilterForm,
 )
 from .models import Answer, Question
-from .service.elasticsearch import search_for_questions
+from .service import (
+    elasticsearch,
+    export,
+    metrics,
+    outbox,
+    page_cache,
+    rendering,
+    replicas,
+    search_cache,
+)
+from .service.search import (
+    SearchUnavailable,
+    search_for_questions,
+    suggest_titles,
+)
+from .service.keyset import created_page
+
+
+class ReplicaReadMixin:
+    """
+    Read from a replica while handling GET requests, including rendering
+    the response, unless the client was pinned to the primary by a
+    recent write or the page is stored in the anonymous page cache.
+
+    Cached pages and their validators come from the primary, since a
+    lagging replica would store the page as it was before a write under
+    the version the write bumped.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if (request.method not in ('GET', 'HEAD')
+                or replicas.is_pinned(request)
+                or (isinstance(self, AnonymousPageCacheMixin)
+                    and self.is_page_cached())):
+            return super().dispatch(request, *args, **kwargs)
+        with replicas.replica_reads():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+
+
+class AnonymousPageCacheMixin:
+    """
+    Serve GET requests from logged out users from the page cache.
+
+    Subclasses provide get_page_version_key(), naming the version that
+    model changes bump to invalidate the page.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not self.is_page_cached():
+            return super().get(request, *args, **kwargs)
+
+        def render():
+            response = super(AnonymousPageCacheMixin, self).get(
+                request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        return page_cache.get_or_render(
+            self.get_page_version_key(), request.get_full_path(), render)
+
+    def get_page_version_key(self):
+        raise NotImplementedError
+
+    def is_page_cached(self):
+        user = getattr(self.request, 'user', None)
+        return user is not None and not user.is_authenticated
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET requests with 304 Not Modified before doing any other work
+    when the client's copy is still current.
+
+    Subclasses provide get_validators(), returning the page's ETag and
+    last modification time (either may be None).
+    """
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        if etag is not None:
+            etag = quote_etag(etag)
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+        response = super().get(request, *args, **kwargs)
+        if getattr(response, 'is_stale', False):
+            return response
+        if etag is not None:
+            response.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.setdefault('Last-Modified', http_date(last_modified))
+        return response
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def make_etag(self, *parts):
+        """
+        Hash parts together with the requesting user, whose forms and
+        controls are part of the page, and for a logged in user the CSRF
+        token those forms embed, which changes when they log in again.
+        """
+        user = getattr(self.request, 'user', None)
+        user_id = user.pk if user is not None else None
+        parts += (user_id,)
+        if user is not None and user.is_authenticated:
+            # Creates the CSRF cookie if this is the first page rendered.
+            get_token(self.request)
+            parts += (self.request.META['CSRF_COOKIE'],)
+        return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+    def get_last_modified(self, last_modified):
+        """
+        Last-Modified only identifies the page for anonymous users, since
+        unlike the ETag it can't tell apart the pages of different users.
+        """
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return None
+        return last_modified
 
 
 class AnswerCreateView(LoginRequiredMixin, CreateView):
@@ -56,6 +199,19 @@ class AnswerCreateView(LoginRequiredMixin, CreateView):
         return Question.objects.get(pk=self.kwargs['pk'])
 
 
+class MarkdownPreviewView(LoginRequiredMixin, View):
+    """
+    Render posted Markdown as JSON for the live preview, without the
+    full-page round trip of the forms' PREVIEW action.
+    """
+
+    def post(self, request, *args, **kwargs):
+        text = request.POST.get('text', '')
+        if len(text) > settings.MARKDOWN_PREVIEW_MAX_LENGTH:
+            return JsonResponse({'error': 'Text is too long.'}, status=400)
+        return JsonResponse({'html': rendering.render_preview(text)})
+
+
 class AnswerAcceptanceUpdateView(LoginRequiredMixin, UpdateView):
     form_class = AnswerAcceptanceForm
     queryset = Answer.objects.all()
@@ -94,14 +250,17 @@ class QuestionCreateView(LoginRequiredMixin, CreateView):
         return self.object.get_absolute_url()
 
 
-class QuestionDetailView(DetailView):
-    model = Question
+class QuestionDetailView(
+        ReplicaReadMixin, ConditionalGetMixin, AnonymousPageCacheMixin,
+        DetailView):
+    queryset = Question.objects.select_related('user')
 
     ACCEPT_FORM = AnswerAcceptanceForm(initial={'accepted': True})
     REJECT_FORM = AnswerAcceptanceForm(initial={'accepted': False})
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context.update(self.get_answers_page())
         context.update({
             'answer_form': AnswerForm(initial={
                 'user': self.request.user.id,
@@ -115,13 +274,83 @@ class QuestionDetailView(DetailView):
             })
         return context
 
+    def get_answers_page(self):
+        """
+        One page of answers, newest first and keyset-paginated by the
+        `after` cursor, with accepted answers pinned to the first page.
+        """
+        after = self.request.GET.get('after')
+        answers = self.object.answer_set.select_related('user')
+        pinned = [] if after else list(answers.filter(accepted=True))
+        try:
+            page, next_after = created_page(
+                answers.filter(accepted=False),
+                settings.ANSWERS_PAGE_SIZE,
+                cursor=after,
+            )
+        except ValueError:
+            raise Http404('Invalid page.')
+        return {
+            'answers': pinned + page,
+            'next_answers_after': next_after,
+        }
+
+    def get_page_version_key(self):
+        return page_cache.question_version_key(self.kwargs['pk'])
 
-class DailyQuestionListView(DayArchiveView):
-    queryset = Question.objects.all()
+    def get_validators(self):
+        freshness = Question.objects.filter(pk=self.kwargs['pk']).aggregate(
+            question_modified=Max('modified'),
+            answer_modified=Max('answer__modified'),
+            answers=Count('answer'),
+        )
+        if freshness['question_modified'] is None:
+            return None, None
+        last_modified = max(
+            freshness['question_modified'],
+            freshness['answer_modified'] or freshness['question_modified'],
+        )
+        etag = self.make_etag(last_modified, freshness['answers'])
+        return etag, self.get_last_modified(last_modified)
+
+
+class DailyQuestionListView(
+        ReplicaReadMixin, ConditionalGetMixin, AnonymousPageCacheMixin,
+        DayArchiveView):
+    queryset = Question.objects.select_related('user').only(
+        'title', 'created', 'user__username')
     date_field = 'created'
     month_format = '%m'
     allow_empty = True
 
+    def get_page_version_key(self):
+        return page_cache.day_version_key(self.get_archive_date())
+
+    def get_validators(self):
+        day = self.get_archive_date()
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        freshness = Question.objects.filter(
+            created__gte=start,
+            created__lt=start + timedelta(days=1),
+        ).aggregate(
+            last_modified=Max('modified'),
+            questions=Count('id'),
+        )
+        last_modified = freshness['last_modified']
+        # Today's date decides whether a "Next Day" link is shown.
+        etag = self.make_etag(
+            day, last_modified, freshness['questions'], timezone.localdate())
+        if last_modified is None:
+            return etag, None
+        return etag, self.get_last_modified(last_modified)
+
+    def get_archive_date(self):
+        try:
+            return date(
+                self.kwargs['year'], self.kwargs['month'], self.kwargs['day'])
+        except ValueError:
+            raise Http404('Invalid date.')
+
 
 class TodaysQuestionListView(RedirectView):
     def get_redirect_url(self, *args, **kwargs):
@@ -136,13 +365,168 @@ class TodaysQuestionListView(RedirectView):
         )
 
 
-class SearchView(TemplateView):
+class SearchView(ReplicaReadMixin, TemplateView):
     template_name = 'qanda/search.html'
 
     def get_context_data(self, **kwargs):
         query = self.request.GET.get('q', None)
         context = super().get_context_data(query=query, **kwargs)
         if query:
-            results = search_for_questions(query)
-            context['hits'] = results
+            filter_form = SearchFilterForm(self.request.GET)
+            if not filter_form.is_valid():
+                raise Http404('Invalid filter.')
+            try:
+                page = int(self.request.GET.get('page', 1))
+                after = self.request.GET.get('after')
+                # Only search_after can reach past the result window.
+                if page < 1 or not after and (
+                        page * settings.SEARCH_PAGE_SIZE
+                        > settings.SEARCH_MAX_RESULT_WINDOW):
+                    raise ValueError(page)
+                results = search_for_questions(
+                    query,
+                    page=page,
+                    after=after,
+                    filters=filter_form.cleaned_data,
+                )
+            except ValueError:
+                raise Http404('Invalid page.')
+            except SearchUnavailable:
+                context['search_unavailable'] = True
+                return context
+            facets = results['facets']
+            next_url = None
+            if results['next']:
+                next_url = self.get_search_url(
+                    page=page + 1, after=results['next'])
+            context.update({
+                'hits': results['hits'],
+                'total': results['total'],
+                'page': page,
+                'next_after': results['next'],
+                'next_url': next_url,
+                'month_facets': [
+                    dict(month, url=self.get_search_url(
+                        since=month['since'], until=month['until']))
+                    for month in facets['months']
+                ],
+                'author_facets': [
+                    dict(author, url=self.get_search_url(
+                        author=author['user']))
+                    for author in facets['authors']
+                ],
+                'accepted_url': self.get_search_url(has_accepted='true'),
+                'filtered': any(
+                    value not in (None, '')
+                    for value in filter_form.cleaned_data.values()),
+                'unfiltered_url': '?' + urlencode({'q': query}),
+            })
         return context
+
+    def get_search_url(self, **params):
+        """
+        The current search, narrowed by params, from its first page unless
+        params give another.
+        """
+        query = self.request.GET.copy()
+        query.pop('page', None)
+        query.pop('after', None)
+        for name, value in params.items():
+            query[name] = str(value)
+        return '?' + query.urlencode()
+
+
+class TypeaheadView(View):
+    """
+    Title suggestions for a search box prefix as small JSON, cacheable per
+    prefix by browsers and proxies.
+    """
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.GET.get('prefix', '')
+        try:
+            suggestions = suggest_titles(prefix)
+        except SearchUnavailable:
+            return JsonResponse({'suggestions': []}, status=503)
+        response = JsonResponse({'suggestions': [
+            {'id': s['id'], 'title': s['title']} for s in suggestions
+        ]})
+        patch_cache_control(
+            response, public=True, max_age=settings.TYPEAHEAD_MAX_AGE)
+        return response
+
+
+class ExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Stream questions and answers as a JSONL or CSV download for staff,
+    optionally limited to questions created between ?since= and ?until=.
+    """
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get('format', 'jsonl')
+        if fmt not in export.FORMATS:
+            return HttpResponseBadRequest()
+        dates = {}
+        for name in ('since', 'until'):
+            value = request.GET.get(name)
+            if value:
+                try:
+                    dates[name] = parse_date(value)
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    return HttpResponseBadRequest()
+        response = StreamingHttpResponse(
+            export.iter_lines(export.iter_records(**dates), fmt),
+            content_type=export.CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="questions.{}"'.format(fmt))
+        return response
+
+
+class MetricsView(View):
+    """
+    This process' metrics in the Prometheus text format, for staff and for
+    scrapers presenting METRICS_TOKEN.
+    """
+
+    def get(self, request, *args, **kwargs):
+        token = settings.METRICS_TOKEN
+        authorized = (
+            token and hmac.compare_digest(
+                request.META.get('HTTP_AUTHORIZATION', '').encode(),
+                'Bearer {}'.format(token).encode())
+        ) or request.user.is_staff
+        if not authorized:
+            return HttpResponseForbidden()
+        return HttpResponse(
+            metrics.render_prometheus(self.get_gauges()),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def get_gauges(self):
+        pool = elasticsearch.get_pool_stats()
+        cache_stats = search_cache.get_stats()
+        return [
+            ('answerly_elasticsearch_pool_connections',
+             'Connections opened by the Elasticsearch client pool.',
+             [({'host': p['host']}, p['connections_opened']) for p in pool]),
+            ('answerly_elasticsearch_pool_requests',
+             'Requests made through the Elasticsearch client pool.',
+             [({'host': p['host']}, p['requests']) for p in pool]),
+            ('answerly_search_cache_lookups',
+             'Search cache lookups by result.',
+             [({'result': name}, value)
+              for name, value in sorted(cache_stats.items())]),
+            ('answerly_outbox_lag_seconds',
+             'Age of the oldest unindexed outbox entry.',
+             [({}, outbox.get_lag())]),
+            ('answerly_replica_lag_seconds',
+             'Replication lag of each read replica.',
+             [({'database': alias}, lag)
+              for alias, lag in replicas.get_lags().items()
+              if lag is not None]),
+        ]
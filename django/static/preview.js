@@ -0,0 +1,51 @@
+// Previews Markdown in place through the JSON preview endpoint. Forms keep
+// their PREVIEW button, which does a full page round trip without script.
+(function () {
+  function attach(form) {
+    var field = form.elements[form.dataset.previewField];
+    var target = document.getElementById(form.dataset.previewTarget);
+    var body = target.querySelector('[data-preview-body]');
+    var button = form.querySelector('button[value="PREVIEW"]');
+
+    button.addEventListener('click', function (event) {
+      event.preventDefault();
+      var data = new FormData();
+      data.append('text', field.value);
+      fetch(form.dataset.previewUrl, {
+        method: 'POST',
+        body: data,
+        credentials: 'same-origin',
+        headers: {'X-CSRFToken': form.elements.csrfmiddlewaretoken.value},
+      })
+        .then(function (response) {
+          if (!response.ok) {
+            throw new Error(response.statusText);
+          }
+          return response.json();
+        })
+        .then(function (result) {
+          // The endpoint returns HTML sanitized by the same bleach
+          // whitelist as saved posts.
+          body.innerHTML = result.html;
+          target.hidden = false;
+        })
+        .catch(function () {
+          form.appendChild(hiddenAction());
+          form.submit();
+        });
+    });
+  }
+
+  function hiddenAction() {
+    var input = document.createElement('input');
+    input.type = 'hidden';
+    input.name = 'action';
+    input.value = 'PREVIEW';
+    return input;
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    var forms = document.querySelectorAll('form[data-preview-url]');
+    Array.prototype.forEach.call(forms, attach);
+  });
+})();
@@ -0,0 +1,58 @@
+// Fills the search box's datalist with title suggestions as the user types.
+// Requests are debounced, and each prefix is fetched at most once per page.
+(function () {
+  var DEBOUNCE_MS = 150;
+  var MIN_PREFIX = 2;
+
+  function attach(input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var url = input.dataset.typeaheadUrl;
+    var seen = {};
+    var timer = null;
+    var latest = '';
+
+    function render(suggestions) {
+      while (list.firstChild) {
+        list.removeChild(list.firstChild);
+      }
+      suggestions.forEach(function (suggestion) {
+        var option = document.createElement('option');
+        option.value = suggestion.title;
+        list.appendChild(option);
+      });
+    }
+
+    function fetchSuggestions(prefix) {
+      if (seen.hasOwnProperty(prefix)) {
+        render(seen[prefix]);
+        return;
+      }
+      fetch(url + '?prefix=' + encodeURIComponent(prefix))
+        .then(function (response) {
+          return response.ok ? response.json() : {suggestions: []};
+        })
+        .then(function (data) {
+          seen[prefix] = data.suggestions;
+          if (prefix === latest) {
+            render(data.suggestions);
+          }
+        })
+        .catch(function () {});
+    }
+
+    input.addEventListener('input', function () {
+      latest = input.value.trim().toLowerCase().replace(/\s+/g, ' ');
+      clearTimeout(timer);
+      if (latest.length < MIN_PREFIX) {
+        render([]);
+        return;
+      }
+      timer = setTimeout(fetchSuggestions, DEBOUNCE_MS, latest);
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    var inputs = document.querySelectorAll('input[data-typeahead-url]');
+    Array.prototype.forEach.call(inputs, attach);
+  });
+})();